@@ -0,0 +1,33 @@
+"""Server entry point: python -m backend
+
+Runs uvicorn with the uvloop event loop and httptools HTTP parser when they
+are installed (uvloop is unavailable on Windows), falling back to asyncio/h11.
+"""
+
+import importlib.util
+
+import uvicorn
+
+from backend.config_loader import load_config
+
+
+def _has_module(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+def main():
+    server = load_config().server
+    uvicorn.run(
+        "backend.main:app",
+        host=server.host,
+        port=server.port,
+        # app.state (runtime config, loaded indexes) is per-process, so
+        # multiple workers only make sense for read-only deployments.
+        workers=server.workers,
+        loop="uvloop" if _has_module("uvloop") else "asyncio",
+        http="httptools" if _has_module("httptools") else "h11",
+    )
+
+
+if __name__ == "__main__":
+    main()
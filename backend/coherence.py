@@ -0,0 +1,91 @@
+"""Deterministic coherence checks for explicit-mode tag expansion.
+
+Contradictions that can be decided from the tag list alone (a gagged character
+performing oral acts, partner positions in a solo scene, ...) are filtered here
+after the model submits its tags, instead of being spelled out in the prompt.
+"""
+
+from typing import Iterable, List
+
+# Actions that need free hands / eyes / mouth
+_HAND_ACTIONS = frozenset({
+    "handjob", "double_handjob", "fingering", "grabbing", "gripping", "holding",
+    "hand_on_hip", "hand_on_own_hip", "hands_on_hips", "hand_on_own_chest",
+    "waving", "v", "peace_sign", "covering_breasts", "covering_crotch",
+})
+_EYE_CONTACT = frozenset({"eye_contact", "looking_at_viewer"})
+_ORAL_ACTIONS = frozenset({
+    "tongue_out", "fellatio", "irrumatio", "deepthroat", "cunnilingus",
+    "anilingus", "licking", "licking_penis", "kiss", "french_kiss",
+})
+
+_RESTRAINTS = ("bound_wrists", "arms_behind_back", "handcuffs", "rope", "tied_up", "bondage")
+_GAGS = ("gag", "ball_gag", "bit_gag", "cleave_gag", "tape_gag", "gagged")
+
+# Tag present in the scene -> tags that cannot appear alongside it.
+# These constrain the character wearing the restraint, so they are only
+# applied when the scene has a single character (see validate_coherence).
+FORBIDDEN_WITH: dict[str, frozenset] = {
+    **{t: _HAND_ACTIONS for t in _RESTRAINTS},
+    "blindfold": _EYE_CONTACT,
+    **{t: _ORAL_ACTIONS for t in _GAGS},
+}
+
+# Tags that need a partner, and tags that need three or more participants
+PARTNER_TAGS = frozenset({
+    "sex", "hetero", "yuri", "yaoi", "missionary", "cowgirl_position",
+    "reverse_cowgirl_position", "doggystyle", "standing_sex", "prone_bone",
+    "mating_press", "suspended_congress", "lotus_position", "spooning",
+    "leg_lock", "fellatio", "cunnilingus", "paizuri", "handjob", "irrumatio",
+    "tribadism", "scissoring", "strap-on", "kiss", "french_kiss",
+})
+GROUP_TAGS = frozenset({
+    "group_sex", "threesome", "ffm_threesome", "mmf_threesome", "foursome",
+    "gangbang", "orgy", "double_penetration", "spitroast", "train_position",
+})
+
+_EJACULATION_TAGS = frozenset({
+    "cum", "cum_on_body", "cum_on_face", "cum_on_breasts", "cum_in_pussy",
+    "cum_in_mouth", "cum_in_ass", "facial", "ejaculation", "bukkake",
+})
+_MASTURBATION_TAGS = frozenset({"masturbation", "female_masturbation"})
+_MALE_COUNT_TAGS = ("1boy", "2boys", "3boys", "multiple_boys")
+
+
+def normalize_tag(tag: str) -> str:
+    return tag.strip().lower().replace(" ", "_")
+
+
+def validate_coherence(
+    tags: List[str],
+    base_tags: Iterable[str] = (),
+    character_type: str = "solo",
+) -> List[str]:
+    """Drop tags that contradict the rest of the scene.
+
+    Base tags are never removed; order of the remaining tags is preserved.
+    character_type is the solo/duo/group hint from detect_character_type().
+    """
+    present = {normalize_tag(t) for t in tags}
+    protected = {normalize_tag(t) for t in base_tags}
+
+    banned = set()
+    if character_type == "solo":
+        banned |= PARTNER_TAGS | GROUP_TAGS
+        for t in present & FORBIDDEN_WITH.keys():
+            banned |= FORBIDDEN_WITH[t]
+        if present & _MASTURBATION_TAGS and not present.intersection(_MALE_COUNT_TAGS):
+            banned |= _EJACULATION_TAGS
+    elif character_type == "duo":
+        banned |= GROUP_TAGS
+
+    banned -= protected
+    if not banned:
+        return list(tags)
+    return [t for t in tags if normalize_tag(t) not in banned]
+
+
+def drop_forbidden(tags: List[str], forbidden: frozenset, base_tags: Iterable[str] = ()) -> List[str]:
+    """Drop tags found in a forbidden set, keeping base tags and order."""
+    protected = {normalize_tag(t) for t in base_tags}
+    return [t for t in tags if normalize_tag(t) not in forbidden or normalize_tag(t) in protected]
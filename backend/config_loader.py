@@ -16,6 +16,7 @@ class LLMConfig(BaseModel):
     api_key: str = ""
     ollama_base_url: str = "http://localhost:11434"
     temperature: float = 0.7
+    max_concurrent_streams: int = 8
 
 
 class MatchingConfig(BaseModel):
@@ -28,6 +29,7 @@ class MatchingConfig(BaseModel):
 class ServerConfig(BaseModel):
     host: str = "127.0.0.1"
     port: int = 8000
+    workers: int = 1
 
 
 class AppConfig(BaseModel):
@@ -11,12 +11,13 @@ import random
 import logging
 import asyncio
 import time
-from typing import Optional, AsyncGenerator, List
+from typing import Callable, Optional, AsyncGenerator, List
 
+from backend.coherence import drop_forbidden, validate_coherence
 from backend.config_loader import LLMConfig
 from backend.usage_tracker import record_usage
 from backend.prompt_templates import (
-    TAG_GENERATION_PROMPT,
+    SYSTEM_PROMPT_GENERATE,
     SYSTEM_PROMPT_FUNCTION_CALLING,
     SYSTEM_PROMPT_FUNCTION_CALLING_DETAILED,
     SYSTEM_PROMPT_RANDOM_EXPAND,
@@ -28,9 +29,12 @@ from backend.prompt_templates import (
     SYSTEM_PROMPT_IMAGE_ANALYSIS_FUNCTION_CALLING_DETAILED,
     IMAGE_ANALYSIS_CHAT_PRESET_NORMAL,
     IMAGE_ANALYSIS_CHAT_PRESET_DETAILED,
+    FORBIDDEN_BOOST_TAGS,
     build_anima_mode_section,
     build_custom_tags_section,
     build_generate_prompt,
+    render_generate,
+    system_prompt_cache_key,
 )
 
 logger = logging.getLogger(__name__)
@@ -459,8 +463,26 @@ def _format_sse(event_type: str, data: dict) -> str:
     return f"data: {json.dumps({'type': event_type, 'data': data}, ensure_ascii=False)}\n\n"
 
 
+def _apply_post_filter(tags: list, post_filter, log_ctx: _LogContext):
+    """Run an optional post-filter over the submitted tags.
+
+    Returns the kept tags and an SSE log event listing the removed ones,
+    or None when nothing was removed.
+    """
+    if post_filter is None:
+        return tags, None
+    kept = post_filter(tags)
+    if len(kept) == len(tags):
+        return kept, None
+    kept_set = set(kept)
+    removed = [t for t in tags if t not in kept_set]
+    return kept, _format_sse("log", log_ctx.create_log_entry(
+        "info", f"Removed {len(removed)} conflicting tags: {', '.join(removed)}", "Coherence Filter"
+    ))
+
+
 # ---------------------------------------------------------------------------
-# Tool builder: creates search_tags / submit_final_tags tools for LangChain
+# Tool builder: creates search_tags / batch_search_tags / submit_final_tags tools for LangChain
 # ---------------------------------------------------------------------------
 
 
@@ -509,16 +531,7 @@ def _build_tools(tag_db, vector_search, custom_tags: Optional[List[str]] = None,
     """Build LangChain tools for function calling mode."""
     from langchain_core.tools import tool as langchain_tool
 
-    @langchain_tool
-    def search_tags(query: str, category: Optional[int] = None, limit: int = 20) -> str:
-        """Search for valid Danbooru tags in the database by semantic similarity.
-        Returns matching tags with their category and usage count.
-
-        Args:
-            query: Search query - a partial tag name, concept, or keyword.
-            category: Optional category filter. 0=general, 1=artist, 3=copyright, 4=character, 5=meta.
-            limit: Maximum number of results to return (default: 20, max: 50).
-        """
+    def _search(query: str, category: Optional[int], limit: int) -> dict:
         limit = min(limit or 20, 50)
         results = []
 
@@ -557,7 +570,39 @@ def _build_tools(tag_db, vector_search, custom_tags: Optional[List[str]] = None,
                     results.append({"tag": ct, "category": 0, "count": 0, "similarity": 0.7})
 
         results.sort(key=lambda x: x["count"], reverse=True)
-        return json.dumps({"tags": results[:limit], "totalFound": len(results)})
+        return {"tags": results[:limit], "totalFound": len(results)}
+
+    @langchain_tool
+    def search_tags(query: str, category: Optional[int] = None, limit: int = 20) -> str:
+        """Search for valid Danbooru tags in the database by semantic similarity.
+        Returns matching tags with their category and usage count.
+
+        Args:
+            query: Search query - a partial tag name, concept, or keyword.
+            category: Optional category filter. 0=general, 1=artist, 3=copyright, 4=character, 5=meta.
+            limit: Maximum number of results to return (default: 20, max: 50).
+        """
+        return json.dumps(_search(query, category, limit))
+
+    @langchain_tool
+    async def batch_search_tags(
+        queries: List[str], categories: Optional[List[int]] = None, limit: int = 20,
+    ) -> str:
+        """Search for several concepts in one call. Each query is searched like search_tags()
+        and the searches run concurrently. Returns one result set per query, in order.
+
+        Args:
+            queries: Search queries, one per visual element (partial tag names, concepts, or keywords).
+            categories: Optional category filters aligned with queries; missing entries mean no filter.
+                0=general, 1=artist, 3=copyright, 4=character, 5=meta.
+            limit: Maximum number of results per query (default: 20, max: 50).
+        """
+        cats = list(categories or [])[:len(queries)]
+        cats += [None] * (len(queries) - len(cats))
+        results = await asyncio.gather(*(
+            asyncio.to_thread(_search, q, c, limit) for q, c in zip(queries, cats)
+        ))
+        return json.dumps({"searches": [{"query": q, **r} for q, r in zip(queries, results)]})
 
     @langchain_tool
     def submit_final_tags(tags: List[str], reasoning: str = "") -> str:
@@ -570,7 +615,7 @@ def _build_tools(tag_db, vector_search, custom_tags: Optional[List[str]] = None,
         normalized = [t.strip().lower().replace(" ", "_") for t in tags]
         return json.dumps({"accepted": True, "tags": normalized, "count": len(normalized)})
 
-    tools = [search_tags, submit_final_tags]
+    tools = [batch_search_tags, search_tags, submit_final_tags]
 
     if detailed:
         @langchain_tool
@@ -611,19 +656,32 @@ def _build_tools(tag_db, vector_search, custom_tags: Optional[List[str]] = None,
                     })
             return json.dumps({"originalTag": tag, "similarTags": results})
 
-        tools = [search_tags, validate_tag, get_similar_tags, submit_final_tags]
+        tools = [batch_search_tags, search_tags, validate_tag, get_similar_tags, submit_final_tags]
 
     return tools
 
 
-def _create_llm_instance(config: LLMConfig, temperature_override: Optional[float] = None):
-    """Create a LangChain LLM instance."""
+def _create_llm_instance(
+    config: LLMConfig,
+    temperature_override: Optional[float] = None,
+    prompt_cache_key: Optional[str] = None,
+):
+    """Create a LangChain LLM instance.
+
+    prompt_cache_key routes requests that share a static system prompt to the
+    same OpenAI prompt cache. Gemini and Ollama reuse cached prefixes
+    implicitly, so the key is not sent to them.
+    """
     temp = temperature_override if temperature_override is not None else config.temperature
     provider = config.provider.lower()
 
     if provider == "openai":
         from langchain_openai import ChatOpenAI
-        return ChatOpenAI(model=config.model, api_key=config.api_key, temperature=temp)
+        extra_body = {"prompt_cache_key": prompt_cache_key} if prompt_cache_key else None
+        return ChatOpenAI(
+            model=config.model, api_key=config.api_key, temperature=temp,
+            extra_body=extra_body,
+        )
     elif provider == "gemini":
         from langchain_google_genai import ChatGoogleGenerativeAI
         kwargs: dict = dict(
@@ -667,6 +725,7 @@ async def _run_tool_loop_native_gemini(
     image_url: Optional[str] = None,
     chat_preset: Optional[str] = None,
     tag_db=None,
+    post_filter: Optional[Callable[[List[str]], List[str]]] = None,
 ) -> AsyncGenerator[str, None]:
     """Run the function-calling loop using the native google-genai SDK.
 
@@ -814,6 +873,9 @@ async def _run_tool_loop_native_gemini(
             if brace_match:
                 tags = [t.strip() for t in brace_match.group(1).split(",") if t.strip()]
                 if tags:
+                    tags, filter_event = _apply_post_filter(tags, post_filter, log_ctx)
+                    if filter_event:
+                        yield filter_event
                     enriched = _enrich_final_tags(tags, tag_db)
                     tag_names = [t["tag"].replace("_", " ") for t in enriched]
                     await record_usage(_build_usage())
@@ -867,6 +929,9 @@ async def _run_tool_loop_native_gemini(
         # Check if submit_final_tags was called
         if final_result is not None:
             raw_tags = final_result.get("tags", [])
+            raw_tags, filter_event = _apply_post_filter(raw_tags, post_filter, log_ctx)
+            if filter_event:
+                yield filter_event
             enriched = _enrich_final_tags(raw_tags, tag_db)
             tag_names = [t["tag"].replace("_", " ") for t in enriched]
             yield _format_sse("log", log_ctx.create_log_entry(
@@ -894,12 +959,12 @@ class LLMService:
     def __init__(self, config: LLMConfig):
         self.config = config
         self.llm = None
-        self.chain = None
         self._init_llm()
 
     def _init_llm(self):
-        self.llm = _create_llm_instance(self.config)
-        self.chain = TAG_GENERATION_PROMPT | self.llm
+        self.llm = _create_llm_instance(
+            self.config, prompt_cache_key=system_prompt_cache_key(SYSTEM_PROMPT_GENERATE),
+        )
 
     def update_config(self, config: LLMConfig):
         """Update LLM configuration at runtime."""
@@ -919,10 +984,7 @@ class LLMService:
     ) -> List[str]:
         """Generate raw tags from natural language description (legacy mode)."""
         user_prompt = build_generate_prompt(description, include_background, style)
-        response = await self.chain.ainvoke({
-            "description": user_prompt,
-            "num_tags": num_tags,
-        })
+        response = await self.llm.ainvoke(render_generate(user_prompt, num_tags))
         return self._parse_tags(response.content)
 
     # ------------------------------------------------------------------
@@ -964,6 +1026,7 @@ class LLMService:
         async for event in self._run_tool_loop(
             system_prompt, user_prompt, tag_db, vector_search,
             custom_tags=custom_tags, detailed=detailed, log_ctx=log_ctx,
+            prompt_cache_key=system_prompt_cache_key(base_prompt),
         ):
             yield event
 
@@ -1015,9 +1078,17 @@ class LLMService:
         ))
 
         char_type_label = ""
+        base_list = [t for t in base_tags.split(",") if t.strip()]
+        post_filter = None
         if explicit:
             char_type = detect_character_type(base_tags)
-            char_type_label = f"\nCharacter type: {char_type} (STRICTLY follow {char_type} rules)"
+            char_type_label = f"\nCharacter type: {char_type} (follow the {char_type} mode rules and coherence guidance)"
+
+            def post_filter(tags: List[str]) -> List[str]:
+                return validate_coherence(tags, base_list, char_type)
+        elif boost:
+            def post_filter(tags: List[str]) -> List[str]:
+                return drop_forbidden(tags, FORBIDDEN_BOOST_TAGS, base_list)
 
         user_prompt = (
             f"Base character tags (keep ALL of these exactly as-is):\n{base_tags}"
@@ -1032,6 +1103,8 @@ class LLMService:
         async for event in self._run_tool_loop(
             system_prompt, user_prompt, tag_db, vector_search,
             custom_tags=custom_tags, temperature_override=0.9, log_ctx=log_ctx,
+            prompt_cache_key=system_prompt_cache_key(system_prompt_base),
+            post_filter=post_filter,
         ):
             yield event
 
@@ -1073,6 +1146,7 @@ class LLMService:
         async for event in self._run_tool_loop(
             system_prompt, user_prompt, tag_db, vector_search,
             custom_tags=custom_tags, temperature_override=0.8, log_ctx=log_ctx,
+            prompt_cache_key=system_prompt_cache_key(SYSTEM_PROMPT_SCENE_EXPAND),
         ):
             yield event
 
@@ -1137,6 +1211,7 @@ class LLMService:
             system_prompt, user_prompt, tag_db, vector_search,
             custom_tags=custom_tags, detailed=detailed, log_ctx=log_ctx,
             image_url=image_url, chat_preset=chat_preset,
+            prompt_cache_key=system_prompt_cache_key(base_prompt),
         ):
             yield event
 
@@ -1156,6 +1231,8 @@ class LLMService:
         log_ctx: Optional[_LogContext] = None,
         image_url: Optional[str] = None,
         chat_preset: Optional[str] = None,
+        prompt_cache_key: Optional[str] = None,
+        post_filter: Optional[Callable[[List[str]], List[str]]] = None,
     ) -> AsyncGenerator[str, None]:
         """Run the function calling loop.
 
@@ -1165,6 +1242,10 @@ class LLMService:
             chat_preset: Optional pre-seeded AI response for censorship evasion.
                          Inserted before the user message to make the AI
                          "pre-agree" to the task.
+            prompt_cache_key: Optional provider cache key for the static
+                              system prompt prefix.
+            post_filter: Optional callable applied to the submitted tags
+                         before enrichment (e.g. coherence validation).
         """
         if log_ctx is None:
             log_ctx = _LogContext()
@@ -1185,14 +1266,14 @@ class LLMService:
                 self.config, system_prompt, user_prompt, tools,
                 detailed=detailed, log_ctx=log_ctx,
                 image_url=image_url, chat_preset=chat_preset,
-                tag_db=tag_db,
+                tag_db=tag_db, post_filter=post_filter,
             ):
                 yield event
             return
 
         from langchain_core.messages import SystemMessage, HumanMessage, AIMessage, ToolMessage
 
-        llm = _create_llm_instance(self.config, temperature_override)
+        llm = _create_llm_instance(self.config, temperature_override, prompt_cache_key)
         llm_with_tools = llm.bind_tools(tools)
         tool_map = {t.name: t for t in tools}
 
@@ -1289,6 +1370,9 @@ class LLMService:
                 if brace_match:
                     tags = [t.strip() for t in brace_match.group(1).split(",") if t.strip()]
                     if tags:
+                        tags, filter_event = _apply_post_filter(tags, post_filter, log_ctx)
+                        if filter_event:
+                            yield filter_event
                         enriched = _enrich_final_tags(tags, tag_db)
                         tag_names = [t["tag"].replace("_", " ") for t in enriched]
                         await record_usage(_build_usage())
@@ -1336,6 +1420,9 @@ class LLMService:
             # Check if submit_final_tags was called
             if final_result is not None:
                 raw_tags = final_result.get("tags", [])
+                raw_tags, filter_event = _apply_post_filter(raw_tags, post_filter, log_ctx)
+                if filter_event:
+                    yield filter_event
                 enriched = _enrich_final_tags(raw_tags, tag_db)
                 tag_names = [t["tag"].replace("_", " ") for t in enriched]
                 yield _format_sse("log", log_ctx.create_log_entry(
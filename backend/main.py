@@ -1,27 +1,30 @@
 """FastAPI application entry point."""
 
+import asyncio
 import json
 import logging
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List
+from typing import Callable, List
 
+import msgspec
+import numpy as np
 from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 
 from backend.config_loader import load_config, save_config, LLMConfig, AppConfig
 from backend.models import (
     GenerateRequest, GenerateResponse, MatchRequest,
     StreamGenerateRequest, RandomExpandRequest, SceneExpandRequest,
     ImageAnalyzeRequest,
-    ConfigUpdateRequest, ConfigResponse, HealthResponse, TagCandidate,
+    ConfigUpdateRequest, ConfigResponse, HealthResponse,
 )
 from backend.tag_database import TagDatabase
 from backend.vector_search import VectorSearch
 from backend.tag_matcher import TagMatcher
 from backend.llm_service import LLMService
-from backend.usage_tracker import get_usage_summary, reset_usage
+from backend.usage_tracker import flush_usage, get_usage_summary, reset_usage
 
 logger = logging.getLogger(__name__)
 
@@ -38,19 +41,6 @@ SSE_HEADERS = {
 VALID_TAG_SOURCES = ("danbooru", "anima", "merged")
 
 
-def _get_available_sources() -> list:
-    """Return list of tag sources that have pre-built indexes."""
-    available = []
-    for source in VALID_TAG_SOURCES:
-        source_dir = DATA_DIR / source
-        if (source_dir / "tags.json").exists():
-            available.append(source)
-    # Fallback: check legacy merged path
-    if "merged" not in available and (DATA_DIR / "merged_tags.json").exists():
-        available.append("merged")
-    return available
-
-
 def _resolve_source_paths(source: str):
     """Resolve tags.json and faiss_index paths for a given source.
     Returns (tags_path, index_path) or (None, None) if not found."""
@@ -71,47 +61,70 @@ def _resolve_source_paths(source: str):
     return None, None
 
 
-def _load_tag_source(source: str, existing_vs=None):
-    """Load TagDatabase, VectorSearch, and TagMatcher for a source.
-    Reuses existing VectorSearch embedding model if provided."""
-    tags_path, index_path = _resolve_source_paths(source)
+def _build_source_manifest() -> dict:
+    """Resolve paths for every tag source once.
+    Returns {source: (tags_path, index_path)}; paths are None if not built."""
+    return {source: _resolve_source_paths(source) for source in VALID_TAG_SOURCES}
+
+
+def _get_available_sources() -> list:
+    """Return list of tag sources that loaded successfully at startup."""
+    return list(app.state.matchers)
+
+
+def _load_tag_source(source: str, tags_path: str, index_path: str):
+    """Load TagDatabase and VectorSearch for a source from resolved paths.
+    The embedding model is shared across VectorSearch instances."""
     if tags_path is None:
         return None, None, None
 
     tag_db = TagDatabase(tags_path)
     logger.info(f"Loaded {tag_db.total_tags} tags from source '{source}'")
 
-    if existing_vs is not None:
-        existing_vs.reload(index_path)
-        vs = existing_vs
-    else:
-        try:
-            vs = VectorSearch(index_path)
-        except Exception as e:
-            logger.error(f"Failed to load FAISS index for '{source}': {e}")
-            vs = VectorSearch.__new__(VectorSearch)
-            vs.vector_store = None
+    try:
+        vs = VectorSearch(index_path, tag_db=tag_db)
+    except Exception as e:
+        logger.error(f"Failed to load FAISS index for '{source}': {e}")
+        vs = VectorSearch.__new__(VectorSearch)
+        vs.vector_store = None
+        vs.tag_db = tag_db
 
     return tag_db, vs, source
 
 
+def _build_matchers(manifest: dict, matching_config) -> dict:
+    """Load every built source up front so switching is a pointer swap.
+    Returns {source: TagMatcher}; unbuilt sources and sources that fail to
+    load are skipped."""
+    matchers = {}
+    for source, paths in manifest.items():
+        try:
+            tag_db, vs, _ = _load_tag_source(source, *paths)
+        except Exception as e:
+            logger.error(f"Failed to load tag source '{source}': {e}")
+            continue
+        if tag_db is not None:
+            matchers[source] = TagMatcher(tag_db, vs, matching_config)
+    return matchers
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Load resources on startup."""
+    """Load resources on startup; flush pending usage on shutdown."""
     config = load_config()
     app.state.config = config
 
-    # Load tag source
-    source = config.tag_source
-    available = _get_available_sources()
+    # Load all tag sources; the configured one becomes active
+    matchers = _build_matchers(_build_source_manifest(), config.matching)
+    app.state.matchers = matchers
 
-    if source not in available and available:
+    source = config.tag_source
+    if source not in matchers and matchers:
         logger.warning(f"Tag source '{source}' not available. Trying fallback...")
-        source = available[0]
-
-    tag_db, vs, loaded_source = _load_tag_source(source)
+        source = next(iter(matchers))
 
-    if tag_db is None:
+    matcher = matchers.get(source)
+    if matcher is None:
         logger.error(
             "No tag data available. Run: python scripts/build_embeddings.py\n"
             "Or if this is a fresh clone: git lfs pull"
@@ -120,11 +133,14 @@ async def lifespan(app: FastAPI):
         app.state.vector_search = None
         app.state.tag_matcher = None
     else:
-        app.state.tag_db = tag_db
-        app.state.vector_search = vs
-        app.state.tag_matcher = TagMatcher(tag_db, vs, config.matching)
-        config.tag_source = loaded_source
-        logger.info(f"Tag source '{loaded_source}' loaded ({tag_db.total_tags} tags)")
+        app.state.tag_db = matcher.tag_db
+        app.state.vector_search = matcher.vector_search
+        app.state.tag_matcher = matcher
+        config.tag_source = source
+        logger.info(f"Tag source '{source}' active ({matcher.tag_db.total_tags} tags)")
+
+    # Bound concurrent LLM streams; excess requests are rejected with 429
+    app.state.stream_sem = asyncio.Semaphore(max(1, config.llm.max_concurrent_streams))
 
     # Initialize LLM service
     try:
@@ -136,10 +152,69 @@ async def lifespan(app: FastAPI):
 
     yield
 
+    # Usage is flushed on a debounce; write out whatever is still pending
+    await asyncio.shield(flush_usage())
+
 
 app = FastAPI(title="SD Prompt Tag Generator", lifespan=lifespan)
 
 
+def _encode_numpy_scalar(obj):
+    """msgspec enc_hook: numpy scalars (e.g. FAISS scores) as plain Python numbers."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise NotImplementedError(f"Objects of type {type(obj)} are not supported")
+
+
+_json_encoder = msgspec.json.Encoder(enc_hook=_encode_numpy_scalar)
+
+
+def _msgspec_response(content) -> Response:
+    """Encode msgspec response structs directly, bypassing FastAPI's serializer."""
+    return Response(content=_json_encoder.encode(content), media_type="application/json")
+
+
+async def _acquire_stream_slot() -> Callable[[], None]:
+    """Take an SSE stream slot, or reject with 429 when every slot is taken.
+
+    The slot is taken here in the handler, not when the stream starts, so a
+    burst of requests can't all pass the check and then queue. Returns an
+    idempotent release; _StreamSlotResponse and the event generator both
+    call it.
+    """
+    sem = app.state.stream_sem
+    if sem.locked():
+        raise HTTPException(
+            status_code=429,
+            detail="Too many concurrent generation requests. Please try again shortly.",
+        )
+    await sem.acquire()
+
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            sem.release()
+
+    return release
+
+
+class _StreamSlotResponse(StreamingResponse):
+    """SSE response that frees its stream slot however it ends, even if streaming never starts."""
+
+    def __init__(self, content, release: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
 def _sse_error_event(error_msg: str) -> str:
     """Format an SSE error complete event for unexpected exceptions."""
     return (
@@ -150,20 +225,20 @@ def _sse_error_event(error_msg: str) -> str:
 # --- API Routes ---
 
 @app.get("/api/health")
-async def health() -> HealthResponse:
+async def health() -> Response:
     tag_db = app.state.tag_db
     vs = app.state.vector_search
-    return HealthResponse(
+    return _msgspec_response(HealthResponse(
         status="ok",
         index_loaded=vs is not None and getattr(vs, "is_loaded", False),
         tag_count=tag_db.total_tags if tag_db else 0,
         llm_configured=app.state.llm_service is not None,
         tag_source=app.state.config.tag_source,
-    )
+    ))
 
 
 @app.post("/api/generate")
-async def generate_tags(req: GenerateRequest) -> GenerateResponse:
+async def generate_tags(req: GenerateRequest) -> Response:
     """Legacy single-turn generation: LLM -> parse -> match via FAISS."""
     if not app.state.llm_service:
         raise HTTPException(status_code=503, detail="LLM service not configured. Check config.yaml and set your API key.")
@@ -194,11 +269,11 @@ async def generate_tags(req: GenerateRequest) -> GenerateResponse:
         best_tags = [t for t in best_tags if t.category in req.include_categories]
     prompt_preview = ", ".join(t.tag for t in best_tags)
 
-    return GenerateResponse(
+    return _msgspec_response(GenerateResponse(
         tags=matched,
         raw_llm_tags=raw_tags,
         prompt_preview=prompt_preview,
-    )
+    ))
 
 
 # --- SSE Streaming Endpoints ---
@@ -209,6 +284,7 @@ async def generate_tags_stream(req: StreamGenerateRequest):
     Returns SSE stream with progress logs and final tags."""
     if not app.state.llm_service:
         raise HTTPException(status_code=503, detail="LLM service not configured.")
+    release = await _acquire_stream_slot()
 
     tag_db = app.state.tag_db
     vs = app.state.vector_search
@@ -230,9 +306,12 @@ async def generate_tags_stream(req: StreamGenerateRequest):
         except Exception as e:
             logger.exception("Error in generate stream")
             yield _sse_error_event(f"Unexpected error: {str(e)}")
+        finally:
+            release()
 
-    return StreamingResponse(
+    return _StreamSlotResponse(
         event_generator(),
+        release,
         media_type="text/event-stream",
         headers=SSE_HEADERS,
     )
@@ -244,6 +323,7 @@ async def random_expand_stream(req: RandomExpandRequest):
     Returns SSE stream with progress logs and final tags."""
     if not app.state.llm_service:
         raise HTTPException(status_code=503, detail="LLM service not configured.")
+    release = await _acquire_stream_slot()
 
     tag_db = app.state.tag_db
     vs = app.state.vector_search
@@ -264,9 +344,12 @@ async def random_expand_stream(req: RandomExpandRequest):
         except Exception as e:
             logger.exception("Error in random-expand stream")
             yield _sse_error_event(f"Unexpected error: {str(e)}")
+        finally:
+            release()
 
-    return StreamingResponse(
+    return _StreamSlotResponse(
         event_generator(),
+        release,
         media_type="text/event-stream",
         headers=SSE_HEADERS,
     )
@@ -278,6 +361,7 @@ async def scene_expand_stream(req: SceneExpandRequest):
     Returns SSE stream with progress logs and final tags."""
     if not app.state.llm_service:
         raise HTTPException(status_code=503, detail="LLM service not configured.")
+    release = await _acquire_stream_slot()
 
     tag_db = app.state.tag_db
     vs = app.state.vector_search
@@ -296,9 +380,12 @@ async def scene_expand_stream(req: SceneExpandRequest):
         except Exception as e:
             logger.exception("Error in scene-expand stream")
             yield _sse_error_event(f"Unexpected error: {str(e)}")
+        finally:
+            release()
 
-    return StreamingResponse(
+    return _StreamSlotResponse(
         event_generator(),
+        release,
         media_type="text/event-stream",
         headers=SSE_HEADERS,
     )
@@ -322,6 +409,7 @@ async def analyze_image_stream(req: ImageAnalyzeRequest):
     estimated_size = (len(req.image) * 3) / 4
     if estimated_size > max_size:
         raise HTTPException(status_code=400, detail="Image too large (max 4MB).")
+    release = await _acquire_stream_slot()
 
     tag_db = app.state.tag_db
     vs = app.state.vector_search
@@ -341,26 +429,29 @@ async def analyze_image_stream(req: ImageAnalyzeRequest):
         except Exception as e:
             logger.exception("Error in analyze-image stream")
             yield _sse_error_event(f"Unexpected error: {str(e)}")
+        finally:
+            release()
 
-    return StreamingResponse(
+    return _StreamSlotResponse(
         event_generator(),
+        release,
         media_type="text/event-stream",
         headers=SSE_HEADERS,
     )
 
 
 @app.post("/api/match")
-async def match_tag(req: MatchRequest) -> List[TagCandidate]:
+async def match_tag(req: MatchRequest) -> Response:
     if not app.state.tag_matcher:
         raise HTTPException(status_code=503, detail="Tag database not loaded.")
-    return app.state.tag_matcher.match_single_tag(req.tag)
+    return _msgspec_response(app.state.tag_matcher.match_single_tag(req.tag))
 
 
 @app.get("/api/config")
-async def get_config() -> ConfigResponse:
+async def get_config() -> Response:
     cfg = app.state.config
     llm = cfg.llm
-    return ConfigResponse(
+    return _msgspec_response(ConfigResponse(
         provider=llm.provider,
         model=llm.model,
         has_api_key=bool(llm.api_key),
@@ -368,11 +459,11 @@ async def get_config() -> ConfigResponse:
         temperature=llm.temperature,
         tag_source=cfg.tag_source,
         available_sources=_get_available_sources(),
-    )
+    ))
 
 
 @app.put("/api/config")
-async def update_config(req: ConfigUpdateRequest) -> ConfigResponse:
+async def update_config(req: ConfigUpdateRequest) -> Response:
     cfg: AppConfig = app.state.config
     llm_cfg = cfg.llm
 
@@ -400,24 +491,22 @@ async def update_config(req: ConfigUpdateRequest) -> ConfigResponse:
                 status_code=400,
                 detail=f"Invalid tag source: {req.tag_source}. Must be one of {VALID_TAG_SOURCES}",
             )
-        tag_db, vs, _ = _load_tag_source(
-            req.tag_source, existing_vs=app.state.vector_search,
-        )
-        if tag_db is None:
+        matcher = app.state.matchers.get(req.tag_source)
+        if matcher is None:
             raise HTTPException(
                 status_code=400,
                 detail=f"Tag source '{req.tag_source}' not available. Run build_embeddings.py first.",
             )
-        app.state.tag_db = tag_db
-        app.state.vector_search = vs
-        app.state.tag_matcher = TagMatcher(tag_db, vs, cfg.matching)
+        app.state.tag_db = matcher.tag_db
+        app.state.vector_search = matcher.vector_search
+        app.state.tag_matcher = matcher
         cfg.tag_source = req.tag_source
-        logger.info(f"Tag source switched to '{req.tag_source}' ({tag_db.total_tags} tags)")
+        logger.info(f"Tag source switched to '{req.tag_source}' ({matcher.tag_db.total_tags} tags)")
 
     # Save to disk
     save_config(cfg)
 
-    return ConfigResponse(
+    return _msgspec_response(ConfigResponse(
         provider=llm_cfg.provider,
         model=llm_cfg.model,
         has_api_key=bool(llm_cfg.api_key),
@@ -425,7 +514,7 @@ async def update_config(req: ConfigUpdateRequest) -> ConfigResponse:
         temperature=llm_cfg.temperature,
         tag_source=cfg.tag_source,
         available_sources=_get_available_sources(),
-    )
+    ))
 
 
 @app.get("/api/usage")
@@ -437,7 +526,7 @@ async def get_usage():
 @app.delete("/api/usage")
 async def clear_usage():
     """Clear all usage data."""
-    reset_usage()
+    await reset_usage()
     return {"status": "ok", "message": "Usage data cleared"}
 
 
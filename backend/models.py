@@ -1,6 +1,12 @@
-"""Pydantic request/response schemas for the API."""
+"""API schemas.
+
+Requests are validated with Pydantic; responses are msgspec Structs so they
+can be encoded straight to JSON without a model_dump() round-trip.
+"""
 
 from typing import List, Optional
+
+import msgspec
 from pydantic import BaseModel, Field
 
 
@@ -51,7 +57,7 @@ class ImageAnalyzeRequest(BaseModel):
     custom_tags: Optional[List[str]] = None
 
 
-class TagCandidate(BaseModel):
+class TagCandidate(msgspec.Struct):
     tag: str
     category: int
     count: int
@@ -60,7 +66,7 @@ class TagCandidate(BaseModel):
     llm_original: str
 
 
-class GenerateResponse(BaseModel):
+class GenerateResponse(msgspec.Struct):
     tags: List[TagCandidate]
     raw_llm_tags: List[str]
     prompt_preview: str
@@ -79,7 +85,7 @@ class ConfigUpdateRequest(BaseModel):
     tag_source: Optional[str] = None
 
 
-class ConfigResponse(BaseModel):
+class ConfigResponse(msgspec.Struct):
     provider: str
     model: str
     has_api_key: bool
@@ -89,7 +95,7 @@ class ConfigResponse(BaseModel):
     available_sources: List[str] = []
 
 
-class HealthResponse(BaseModel):
+class HealthResponse(msgspec.Struct):
     status: str
     index_loaded: bool
     tag_count: int
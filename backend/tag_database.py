@@ -1,30 +1,103 @@
 """In-memory tag database with exact, alias, and fuzzy matching."""
 
-import json
+import heapq
 import math
 import re
+import sys
+from collections import defaultdict
 from dataclasses import dataclass
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
+from types import MappingProxyType
 from typing import Optional
 
+import marisa_trie
+import msgspec
+import numpy as np
 from rapidfuzz import fuzz, process
 
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class TagEntry:
     tag: str
     category: int
     count: int
-    aliases: list[str]
+    aliases: tuple[str, ...]
+    popularity: float = 0.0  # log-scaled count in [0, 1], set by TagDatabase._load
+
+
+class _TagRecord(msgspec.Struct):
+    """On-disk schema of one tags.json item (extra fields such as "source" are ignored)."""
+    tag: str
+    category: int
+    count: int
+    aliases: list[str] = []
+
+
+_decode_tags = msgspec.json.Decoder(list[_TagRecord]).decode
+
+
+def _normalize_text(text: str) -> str:
+    return text.strip().lower().replace(" ", "_").replace("-", "_")
+
+
+# LLM output repeats the same tags across a session. Queries go through the
+# cached variant; _load uses the plain one so loading doesn't flush the cache.
+_normalize_query = lru_cache(maxsize=4096)(_normalize_text)
+
+# Queries this short skip phase-2 token scoring in fuzzy matching: one or two
+# characters make a single token, and its token score is noise.
+_SHORT_QUERY_LEN = 2
+
+# Fuzzy phase 1 only scores tags that share a near-identical token with the
+# query: vocabulary tokens are pre-filtered by bigram Dice coefficient, then
+# kept if their fuzz.ratio against a query token reaches _NEAR_TOKEN_RATIO.
+# Subsets smaller than _MIN_PRUNED_CANDIDATES are scored as a full scan
+# instead, and a pruned pass with no hit at the threshold is retried in
+# full: merged, split or misspelled tokens can miss the token index entirely.
+_BIGRAM_DICE_MIN = 0.4
+_NEAR_TOKEN_RATIO = 60
+_MIN_PRUNED_CANDIDATES = 500
+
+# Queries per process.cdist call in batch_fuzzy_match; each row is a float64
+# score vector over every tag name.
+_CDIST_CHUNK = 32
+
+
+def _bigrams(token: str) -> set[str]:
+    padded = f"^{token}$"
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def _top_k_indices(row: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k best non-zero scores, best first, ties by lowest index.
+
+    Matches process.extract's selection and ordering (cdist zeroes scores
+    below score_cutoff).
+    """
+    idx = np.flatnonzero(row)
+    if len(idx) > k:
+        vals = row[idx]
+        kth = np.partition(vals, len(vals) - k)[len(vals) - k]
+        above = idx[vals > kth]
+        idx = np.concatenate([above, idx[vals == kth][:k - len(above)]])
+    return idx[np.lexsort((idx, -row[idx]))]
 
 
 class TagDatabase:
     def __init__(self, json_path: str):
+        # alias_map, tag_names and _norm_map are frozen (MappingProxyType /
+        # tuple) at the end of _load
         self.tags: dict[str, TagEntry] = {}
         self.alias_map: dict[str, str] = {}
         self.tag_names: list[str] = []
+        self._tag_tokens: list[list[str]] = []  # parallel to tag_names
         self._norm_map: dict[str, str] = {}  # normalized name → original tag name
         self.max_count: int = 1
+        self._log_max: float = 0.0  # log10(max_count), shared by popularity scoring
+        # Per instance, so switching tag sources never serves another source's hits
+        self._fuzzy_cached = lru_cache(maxsize=2048)(self._fuzzy_match_impl)
         self._load(json_path)
 
     def _load(self, json_path: str):
@@ -32,37 +105,78 @@ class TagDatabase:
         if not path.exists():
             raise FileNotFoundError(f"Tag database not found: {json_path}")
 
-        with open(path, encoding="utf-8") as f:
-            raw = json.load(f)
+        # Typed decode straight into structs, skipping the intermediate dicts
+        records = _decode_tags(path.read_bytes())
 
-        for item in raw:
-            tag = item["tag"]
+        # Entries are immutable, so popularity needs max_count before they are built
+        if records:
+            self.max_count = max(item.count for item in records)
+        self._log_max = math.log10(self.max_count) if self.max_count > 1 else 0.0
+
+        # Names and lookup keys are interned so lookups with interned queries
+        # (see _normalize_once) can short-circuit on identity.
+        for item in records:
+            tag = sys.intern(item.tag)
             entry = TagEntry(
                 tag=tag,
-                category=item["category"],
-                count=item["count"],
-                aliases=item.get("aliases", []),
+                category=item.category,
+                count=item.count,
+                aliases=tuple(item.aliases),
+                popularity=self.normalized_popularity(item.count),
             )
             self.tags[tag] = entry
             self.tag_names.append(tag)
+            self._tag_tokens.append(self._tokenize(tag))
 
             # Build normalized → original mapping for exact match
-            norm = self._normalize(tag)
+            norm = sys.intern(self._normalize(tag))
             if norm not in self._norm_map or entry.count > self.tags[self._norm_map[norm]].count:
                 self._norm_map[norm] = tag
 
             # Build alias map
             for alias in entry.aliases:
-                normalized = self._normalize(alias)
+                normalized = sys.intern(self._normalize(alias))
                 if normalized and normalized not in self.alias_map:
                     self.alias_map[normalized] = tag
 
-        if self.tags:
-            self.max_count = max(e.count for e in self.tags.values())
+        self._build_token_index()
 
-    @staticmethod
-    def _normalize(text: str) -> str:
-        return text.strip().lower().replace(" ", "_").replace("-", "_")
+        # Prefix index over normalized names. _prefix_rank maps trie key id →
+        # position in _norm_map, so prefix results keep the load (popularity) order.
+        self._prefix_trie = marisa_trie.Trie(self._norm_map.keys())
+        self._prefix_rank = [0] * len(self._prefix_trie)
+        for rank, norm in enumerate(self._norm_map):
+            self._prefix_rank[self._prefix_trie[norm]] = rank
+
+        # Lookup tables are read-only once loaded
+        self.tag_names = tuple(self.tag_names)
+        self.alias_map = MappingProxyType(self.alias_map)
+        self._norm_map = MappingProxyType(self._norm_map)
+
+    def _build_token_index(self):
+        """Inverted indexes for pruning fuzzy phase 1: token → tag ids, bigram → token ids."""
+        postings: dict[str, list[int]] = defaultdict(list)
+        for i, tokens in enumerate(self._tag_tokens):
+            for token in dict.fromkeys(tokens):
+                postings[token].append(i)
+        self._token_vocab = list(postings)
+        self._token_postings = [np.array(ids, dtype=np.int32) for ids in postings.values()]
+
+        bigram_ids: dict[str, list[int]] = defaultdict(list)
+        bigram_counts = []
+        for vi, token in enumerate(self._token_vocab):
+            grams = _bigrams(token)
+            bigram_counts.append(len(grams))
+            for g in grams:
+                bigram_ids[g].append(vi)
+        self._bigram_index = {g: np.array(ids, dtype=np.int32) for g, ids in bigram_ids.items()}
+        self._token_bigram_counts = np.array(bigram_counts, dtype=np.int32)
+
+    _normalize = staticmethod(_normalize_text)
+
+    def _normalize_once(self, query: str) -> str:
+        """Normalize a query once so every lookup stage can reuse it."""
+        return sys.intern(_normalize_query(query))
 
     @staticmethod
     def _tokenize(text: str) -> list[str]:
@@ -76,90 +190,220 @@ class TagDatabase:
         Handles cases where the query is a fuzzy subset of the target
         (e.g. heart_pupils → heart-shaped_pupils) or vice versa.
         """
-        q_tokens = TagDatabase._tokenize(query)
-        t_tokens = TagDatabase._tokenize(target)
+        return TagDatabase._token_score(TagDatabase._tokenize(query), TagDatabase._tokenize(target))
+
+    @staticmethod
+    def _token_score(q_tokens: list[str], t_tokens: list[str]) -> float:
+        """_token_fuzzy_score() on pre-tokenized query and target."""
         if not q_tokens or not t_tokens:
             return 0.0
 
         match_threshold = 75
 
+        # Token × token ratio matrix in one call; scores below the threshold
+        # are zeroed since only matched tokens count.
+        mat = process.cdist(
+            q_tokens, t_tokens, scorer=fuzz.ratio,
+            score_cutoff=match_threshold, dtype=np.float64,
+        )
         # Query → Target: how well each query token matches a target token
-        q_scores = [max(fuzz.ratio(qt, tt) for tt in t_tokens)
-                     for qt in q_tokens]
-        q_matched = sum(1 for s in q_scores if s >= match_threshold)
-
+        q_scores = mat.max(axis=1)
         # Target → Query: how well each target token is covered by a query token
-        t_scores = [max(fuzz.ratio(qt, tt) for qt in q_tokens)
-                     for tt in t_tokens]
-        t_matched = sum(1 for s in t_scores if s >= match_threshold)
+        t_scores = mat.max(axis=0)
+        q_matched = int(np.count_nonzero(q_scores))
+        t_matched = int(np.count_nonzero(t_scores))
 
         # Bidirectional coverage: fraction of all tokens that found a match
         coverage = (q_matched + t_matched) / (len(q_tokens) + len(t_tokens))
         if coverage < 0.7:
             return 0.0
 
-        all_matched = [s for s in q_scores + t_scores if s >= match_threshold]
-        if not all_matched:
-            return 0.0
-        avg = sum(all_matched) / len(all_matched)
+        avg = float(q_scores.sum() + t_scores.sum()) / (q_matched + t_matched)
 
         return avg * (0.5 + 0.5 * coverage)
 
     def exact_match(self, query: str) -> Optional["TagEntry"]:
-        normalized = self._normalize(query)
+        return self.exact_match_norm(self._normalize_once(query))
+
+    def exact_match_norm(self, normalized: str) -> Optional["TagEntry"]:
+        """exact_match() for an already-normalized query."""
         original = self._norm_map.get(normalized)
         if original:
             return self.tags.get(original)
         return None
 
     def alias_match(self, query: str) -> Optional["TagEntry"]:
-        normalized = self._normalize(query)
+        return self.alias_match_norm(self._normalize_once(query))
+
+    def alias_match_norm(self, normalized: str) -> Optional["TagEntry"]:
+        """alias_match() for an already-normalized query."""
         canonical = self.alias_map.get(normalized)
         if canonical:
             return self.tags.get(canonical)
         return None
 
     def fuzzy_match(self, query: str, threshold: float = 80, limit: int = 5) -> list[tuple[TagEntry, float]]:
-        normalized = self._normalize(query)
+        return self.fuzzy_match_norm(_normalize_query(query), threshold, limit)
+
+    def fuzzy_match_norm(
+        self, normalized: str, threshold: float = 80, limit: int = 5,
+    ) -> list[tuple[TagEntry, float]]:
+        """fuzzy_match() for an already-normalized query."""
+        # Distance 0: an exact or alias hit is the answer, no need for rapidfuzz
+        direct = self._direct_match(normalized)
+        if direct:
+            return [(direct, 1.0)]
+        # Copy so callers can't mutate the cached list
+        return list(self._fuzzy_cached(normalized, threshold, limit))
+
+    def _direct_match(self, normalized: str) -> Optional["TagEntry"]:
+        return self.exact_match_norm(normalized) or self.alias_match_norm(normalized)
 
-        # Phase 1: Wide-net candidates with lower threshold using fuzz.ratio
+    def _fuzzy_match_impl(
+        self, normalized: str, threshold: float, limit: int, prune: bool = True,
+    ) -> list[tuple[TagEntry, float]]:
+        # Phase 1: Wide-net candidates with lower threshold using fuzz.ratio,
+        # over the tags sharing a near token with the query
         internal_limit = max(limit * 10, 50)
+        subset = self._fuzzy_candidates(normalized) if prune else None
         candidates = process.extract(
             normalized,
-            self.tag_names,
+            self.tag_names if subset is None else [self.tag_names[i] for i in subset.tolist()],
             scorer=fuzz.ratio,
             limit=internal_limit,
             score_cutoff=threshold * 0.7,
         )
+        if subset is not None:
+            candidates = [(name, score, int(subset[pos])) for name, score, pos in candidates]
+        matches = self._rescore(normalized, ((idx, score) for _, score, idx in candidates), threshold, limit)
+        if not matches and subset is not None:
+            return self._fuzzy_match_impl(normalized, threshold, limit, prune=False)
+        return matches
+
+    def _fuzzy_candidates(self, normalized: str) -> Optional[np.ndarray]:
+        """Ascending indices of tags sharing a near-identical token with the query.
+
+        None means score every tag: the query has no tokens, or the subset is
+        too small to be trusted or too large for pruning to pay off.
+        """
+        q_tokens = self._tokenize(normalized)
+        if not q_tokens:
+            return None
 
-        # Phase 2: Re-score with token-level matching and take the best
+        hits = []
+        for token in dict.fromkeys(q_tokens):
+            grams = _bigrams(token)
+            postings = [self._bigram_index[g] for g in grams if g in self._bigram_index]
+            if not postings:
+                continue
+            shared = np.bincount(np.concatenate(postings), minlength=len(self._token_vocab))
+            near = np.flatnonzero(2 * shared >= _BIGRAM_DICE_MIN * (len(grams) + self._token_bigram_counts))
+            if not len(near):
+                continue
+            scores = process.cdist(
+                [token], [self._token_vocab[i] for i in near.tolist()],
+                scorer=fuzz.ratio, score_cutoff=_NEAR_TOKEN_RATIO,
+            )[0]
+            hits.extend(self._token_postings[i] for i in near[scores > 0].tolist())
+
+        if not hits:
+            return None
+        subset = np.unique(np.concatenate(hits))
+        if len(subset) < _MIN_PRUNED_CANDIDATES or len(subset) > len(self.tag_names) // 2:
+            return None
+        return subset
+
+    def _rescore(self, normalized: str, candidates, threshold: float, limit: int) -> list[tuple[TagEntry, float]]:
+        """Phase 2: re-score (index, ratio) candidates with token-level matching and take the best."""
+        q_tokens = self._tokenize(normalized) if len(normalized) > _SHORT_QUERY_LEN else None
         matches = []
-        for tag_name, ratio_score, _ in candidates:
-            token_score = self._token_fuzzy_score(normalized, tag_name)
-            best_score = max(ratio_score, token_score)
+        for idx, ratio_score in candidates:
+            if q_tokens:
+                best_score = max(ratio_score, self._token_score(q_tokens, self._tag_tokens[idx]))
+            else:
+                best_score = ratio_score
             if best_score >= threshold:
-                entry = self.tags.get(tag_name)
+                entry = self.tags.get(self.tag_names[idx])
                 if entry:
                     matches.append((entry, best_score / 100.0))
 
-        # Sort by score descending and return top results
-        matches.sort(key=lambda x: x[1], reverse=True)
-        return matches[:limit]
+        # Top results by score, descending (stable for ties)
+        return heapq.nlargest(limit, matches, key=lambda x: x[1])
+
+    def batch_fuzzy_match(
+        self, queries: list[str], threshold: float = 80, limit: int = 5
+    ) -> list[list[tuple[TagEntry, float]]]:
+        """fuzzy_match_norm() for many normalized queries at once.
+
+        Phase 1 runs as a single process.cdist call over all queries (in
+        chunks, to bound the score matrix) instead of one extract() each.
+        """
+        results: dict[str, list[tuple[TagEntry, float]]] = {}
+        unique = []
+        for q in dict.fromkeys(queries):
+            direct = self._direct_match(q)
+            if direct:
+                results[q] = [(direct, 1.0)]
+            else:
+                unique.append(q)
+        if len(unique) < 2:
+            return [self.fuzzy_match_norm(q, threshold, limit) for q in queries]
+
+        internal_limit = max(limit * 10, 50)
+        for start in range(0, len(unique), _CDIST_CHUNK):
+            chunk = unique[start:start + _CDIST_CHUNK]
+
+            # Score the union of the chunk's token-pruned subsets, masking each
+            # row to its own subset so results match fuzzy_match_norm
+            subsets = [self._fuzzy_candidates(q) for q in chunk]
+            union = None
+            if all(sub is not None for sub in subsets):
+                union = np.unique(np.concatenate(subsets))
+                if len(union) > len(self.tag_names) // 2:
+                    union = None
+
+            scores = process.cdist(
+                chunk,
+                self.tag_names if union is None else [self.tag_names[i] for i in union.tolist()],
+                scorer=fuzz.ratio,
+                score_cutoff=threshold * 0.7,
+                dtype=np.float64,
+                workers=-1,
+            )
+            for query, sub, row in zip(chunk, subsets, scores):
+                if sub is not None:
+                    keep = sub if union is None else np.searchsorted(union, sub)
+                    masked = np.zeros_like(row)
+                    masked[keep] = row[keep]
+                    row = masked
+                top = _top_k_indices(row, internal_limit)
+                ids = top if union is None else union[top]
+                matches = self._rescore(query, zip(ids.tolist(), row[top].tolist()), threshold, limit)
+                if not matches and sub is not None:
+                    matches = self._fuzzy_match_impl(query, threshold, limit, prune=False)
+                results[query] = matches
+
+        return [list(results[q]) for q in queries]
 
     def search_prefix(self, query: str, limit: int = 10) -> list[TagEntry]:
-        normalized = self._normalize(query)
-        results = []
-        for norm, original in self._norm_map.items():
-            if norm.startswith(normalized):
-                results.append(self.tags[original])
-                if len(results) >= limit:
-                    break
-        return results
+        normalized = _normalize_query(query)
+        if not normalized:
+            return [self.tags[original] for original in islice(self._norm_map.values(), limit)]
+        rank = self._prefix_rank
+        hits = heapq.nsmallest(limit, self._prefix_trie.items(normalized), key=lambda kv: rank[kv[1]])
+        return [self.tags[self._norm_map[norm]] for norm, _ in hits]
 
     def normalized_popularity(self, count: int) -> float:
-        if self.max_count <= 1:
+        if self._log_max <= 0.0:
             return 0.0
-        return math.log10(max(count, 1)) / math.log10(self.max_count)
+        return math.log10(max(count, 1)) / self._log_max
+
+    def tag_popularity(self, tag: str, count: int) -> float:
+        """Precomputed popularity for a known tag, computed from count otherwise."""
+        entry = self.tags.get(tag)
+        if entry is not None:
+            return entry.popularity
+        return self.normalized_popularity(count)
 
     @property
     def total_tags(self) -> int:
@@ -1,5 +1,12 @@
 """Multi-strategy tag matching pipeline: exact → alias → fuzzy → vector."""
 
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
 from backend.models import TagCandidate
 from backend.tag_database import TagDatabase
 from backend.vector_search import VectorSearch
@@ -7,6 +14,17 @@ from backend.config_loader import MatchingConfig
 
 
 class TagMatcher:
+    # Shared by all matchers; created on first batch match
+    _pool: Optional[ThreadPoolExecutor] = None
+
+    @classmethod
+    def _get_pool(cls) -> ThreadPoolExecutor:
+        if cls._pool is None:
+            cls._pool = ThreadPoolExecutor(
+                max_workers=min(8, os.cpu_count() or 4), thread_name_prefix="tag-match",
+            )
+        return cls._pool
+
     def __init__(self, tag_db: TagDatabase, vector_search: VectorSearch, config: MatchingConfig):
         self.tag_db = tag_db
         self.vector_search = vector_search
@@ -15,9 +33,35 @@ class TagMatcher:
     def match_single_tag(self, llm_tag: str) -> list[TagCandidate]:
         """Run the full 4-stage pipeline for one LLM-generated tag."""
         llm_tag_stripped = llm_tag.strip()
+        norm = self.tag_db._normalize_once(llm_tag_stripped)
+
+        direct = self._match_direct(llm_tag_stripped, norm)
+        if direct is not None:
+            return direct
+
+        # Stage 3: Fuzzy match
+        fuzzy_results = self.tag_db.fuzzy_match_norm(
+            norm,
+            threshold=80,
+            limit=self.config.max_results_per_tag,
+        )
+
+        # Stage 4: Vector similarity search
+        vector_results = self.vector_search.search(
+            llm_tag_stripped,
+            k=self.config.vector_search_k,
+            normalized_query=norm,
+        )
+
+        # Merge and rank results
+        return self._merge_and_rank(
+            llm_tag_stripped, fuzzy_results, vector_results, self.config.max_results_per_tag,
+        )
 
+    def _match_direct(self, llm_tag_stripped: str, norm: str) -> Optional[list[TagCandidate]]:
+        """Stages 1-2 (exact, then alias). None when neither hits."""
         # Stage 1: Exact match
-        exact = self.tag_db.exact_match(llm_tag_stripped)
+        exact = self.tag_db.exact_match_norm(norm)
         if exact:
             return [TagCandidate(
                 tag=exact.tag,
@@ -29,7 +73,7 @@ class TagMatcher:
             )]
 
         # Stage 2: Alias match
-        alias = self.tag_db.alias_match(llm_tag_stripped)
+        alias = self.tag_db.alias_match_norm(norm)
         if alias:
             return [TagCandidate(
                 tag=alias.tag,
@@ -40,30 +84,54 @@ class TagMatcher:
                 llm_original=llm_tag_stripped,
             )]
 
-        # Stage 3: Fuzzy match
-        fuzzy_results = self.tag_db.fuzzy_match(
-            llm_tag_stripped,
-            threshold=80,
-            limit=self.config.max_results_per_tag,
-        )
+        return None
 
-        # Stage 4: Vector similarity search
-        vector_results = self.vector_search.search(
-            llm_tag_stripped,
-            k=self.config.vector_search_k,
-        )
+    def _match_all(self, llm_tags: list[str]) -> list[list[TagCandidate]]:
+        """match_single_tag() for every tag, running stages 3-4 for all exact/alias misses as batches."""
+        results: list[list[TagCandidate]] = [[] for _ in llm_tags]
+        misses: list[tuple[int, str, str]] = []
 
-        # Merge and rank results
-        candidates = self._merge_and_rank(llm_tag_stripped, fuzzy_results, vector_results)
-        return candidates[:self.config.max_results_per_tag]
+        for i, llm_tag in enumerate(llm_tags):
+            stripped = llm_tag.strip()
+            norm = self.tag_db._normalize_once(stripped)
+            direct = self._match_direct(stripped, norm)
+            if direct is not None:
+                results[i] = direct
+            else:
+                misses.append((i, stripped, norm))
+
+        if misses:
+            queries = [stripped for _, stripped, _ in misses]
+            norms = [norm for _, _, norm in misses]
+            # Stages 3 and 4 spend their time in rapidfuzz and the encoder /
+            # FAISS, which release the GIL, so the vector batch runs alongside
+            vector_future = self._get_pool().submit(
+                self.vector_search.batch_search,
+                queries,
+                k=self.config.vector_search_k,
+                normalized_queries=norms,
+            )
+            fuzzy_batches = self.tag_db.batch_fuzzy_match(
+                norms,
+                threshold=80,
+                limit=self.config.max_results_per_tag,
+            )
+            vector_batches = vector_future.result()
+            for (i, stripped, _), fuzzy_results, vector_results in zip(misses, fuzzy_batches, vector_batches):
+                results[i] = self._merge_and_rank(
+                    stripped, fuzzy_results, vector_results, self.config.max_results_per_tag,
+                )
+
+        return results
 
     def _merge_and_rank(
         self,
         llm_tag: str,
         fuzzy_results: list,
         vector_results: list[dict],
+        limit: int,
     ) -> list[TagCandidate]:
-        """Merge fuzzy and vector results, deduplicate, and rank."""
+        """Merge fuzzy and vector results, deduplicate, and return the top `limit` by rank."""
         seen: dict[str, TagCandidate] = {}
 
         # Add fuzzy results
@@ -98,23 +166,27 @@ class TagMatcher:
                     llm_original=llm_tag,
                 )
 
-        # Rank by weighted score
+        # Rank by weighted score: similarity blended with log-scaled popularity
         candidates = list(seen.values())
+        n = len(candidates)
+        if n < 2:
+            return candidates[:limit]
+
         weight = self.config.count_weight
-        for c in candidates:
-            pop = self.tag_db.normalized_popularity(c.count)
-            c._rank_score = c.similarity_score * (1 - weight) + pop * weight
+        popularity = self.tag_db.tag_popularity
+        sims = np.fromiter((c.similarity_score for c in candidates), dtype=np.float64, count=n)
+        pop = np.fromiter((popularity(c.tag, c.count) for c in candidates), dtype=np.float64, count=n)
+        rank = (sims * (1 - weight) + pop * weight).tolist()
 
-        candidates.sort(key=lambda c: c._rank_score, reverse=True)
-        return candidates
+        # nlargest is stable, so ties keep insertion order (fuzzy before vector)
+        return [candidates[i] for i in heapq.nlargest(limit, range(n), key=rank.__getitem__)]
 
     def match_tags(self, llm_tags: list[str]) -> list[TagCandidate]:
         """Run pipeline for all LLM-generated tags. Returns best match per tag."""
         all_results = []
         seen_tags = set()
 
-        for llm_tag in llm_tags:
-            candidates = self.match_single_tag(llm_tag)
+        for candidates in self._match_all(llm_tags):
             if candidates:
                 # Take the best match that hasn't been seen
                 for c in candidates:
@@ -130,8 +202,7 @@ class TagMatcher:
         all_results = []
         seen_tags = set()
 
-        for llm_tag in llm_tags:
-            candidates = self.match_single_tag(llm_tag)
+        for candidates in self._match_all(llm_tags):
             for c in candidates:
                 if c.tag not in seen_tags:
                     all_results.append(c)
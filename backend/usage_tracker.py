@@ -1,19 +1,32 @@
 """Token usage tracking and persistence."""
 
-import json
 import logging
 import asyncio
+import copy
+import os
 from datetime import date
 from pathlib import Path
 from typing import Optional
 
+import orjson
+
 logger = logging.getLogger(__name__)
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 USAGE_DIR = PROJECT_ROOT / "data" / "usage"
 USAGE_FILE = USAGE_DIR / "usage.json"
 
+# Seconds to batch updates before writing usage.json
+FLUSH_DELAY = 2.0
+
 _lock = asyncio.Lock()
+_write_lock = asyncio.Lock()
+
+# In-memory usage data, loaded lazily; record_usage mutates it and a
+# debounced task writes it out so requests never wait on disk I/O.
+_state: Optional[dict] = None
+_dirty = False
+_flush_task: Optional[asyncio.Task] = None
 
 
 def _empty_totals() -> dict:
@@ -32,22 +45,59 @@ def _load_usage() -> dict:
     if not USAGE_FILE.exists():
         return {"daily": {}, "total": _empty_totals()}
     try:
-        with open(USAGE_FILE, encoding="utf-8") as f:
-            return json.load(f)
-    except (json.JSONDecodeError, OSError) as e:
+        return orjson.loads(USAGE_FILE.read_bytes())
+    except (orjson.JSONDecodeError, OSError) as e:
         logger.warning(f"Failed to load usage data: {e}")
         return {"daily": {}, "total": _empty_totals()}
 
 
-def _save_usage(data: dict) -> None:
-    """Save usage data to JSON file."""
+def _get_state() -> dict:
+    global _state
+    if _state is None:
+        _state = _load_usage()
+    return _state
+
+
+def _write_usage(payload: bytes) -> None:
+    """Atomically replace usage.json with already-serialized data."""
     USAGE_DIR.mkdir(parents=True, exist_ok=True)
-    with open(USAGE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    tmp = USAGE_FILE.with_suffix(".json.tmp")
+    tmp.write_bytes(payload)
+    os.replace(tmp, USAGE_FILE)
+
+
+async def flush_usage() -> None:
+    """Write pending usage to disk now (also called on shutdown)."""
+    global _dirty
+    async with _write_lock:
+        if not _dirty or _state is None:
+            return
+        # Serialize on the loop so the snapshot is consistent; write off it
+        payload = orjson.dumps(_state, option=orjson.OPT_INDENT_2)
+        _dirty = False
+        try:
+            await asyncio.to_thread(_write_usage, payload)
+        except OSError as e:
+            _dirty = True
+            logger.warning(f"Failed to save usage data: {e}")
+
+
+async def _flush_later() -> None:
+    global _flush_task
+    await asyncio.sleep(FLUSH_DELAY)
+    _flush_task = None
+    await flush_usage()
+
+
+def _schedule_flush() -> None:
+    global _dirty, _flush_task
+    _dirty = True
+    if _flush_task is None:
+        _flush_task = asyncio.create_task(_flush_later())
 
 
 async def record_usage(usage: dict) -> None:
-    """Record a single request's token usage. Thread-safe via asyncio lock."""
+    """Record a single request's token usage in memory; written out by a debounced flush."""
     input_t = usage.get("input_tokens", 0)
     output_t = usage.get("output_tokens", 0)
     cache_r = usage.get("cache_read_tokens", 0)
@@ -59,7 +109,7 @@ async def record_usage(usage: dict) -> None:
         return
 
     async with _lock:
-        data = _load_usage()
+        data = _get_state()
         today = date.today().isoformat()
         model_key = f"{usage.get('provider', 'unknown')}/{usage.get('model', 'unknown')}"
 
@@ -94,14 +144,26 @@ async def record_usage(usage: dict) -> None:
         t["total_tokens"] += total_t
         t["request_count"] += 1
 
-        _save_usage(data)
+        _schedule_flush()
 
 
 def get_usage_summary() -> dict:
-    """Get full usage data for the API endpoint."""
-    return _load_usage()
+    """Get full usage data for the API endpoint (a copy; record_usage keeps mutating the live state)."""
+    return copy.deepcopy(_get_state())
 
 
-def reset_usage() -> None:
+async def reset_usage() -> None:
     """Clear all usage data."""
-    _save_usage({"daily": {}, "total": _empty_totals()})
+    global _state, _dirty, _flush_task
+    # A scheduled flush still sleeping can simply be dropped; once it has
+    # started writing it holds _write_lock, so the reset waits for it and
+    # its old snapshot can't land on top of the cleared file
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
+    async with _write_lock:
+        async with _lock:
+            _state = {"daily": {}, "total": _empty_totals()}
+            _dirty = False
+            payload = orjson.dumps(_state, option=orjson.OPT_INDENT_2)
+        await asyncio.to_thread(_write_usage, payload)
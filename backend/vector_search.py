@@ -1,29 +1,117 @@
 """FAISS vector index loading and similarity search."""
 
+import heapq
+import importlib.util
+import platform
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional
 
+import faiss
+import numpy as np
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_huggingface import HuggingFaceEmbeddings
 
+from backend.tag_database import TagDatabase
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBED_CACHE_SIZE = 4096
+
+# Scores for dictionary hits seeded ahead of FAISS results: just under a
+# stage-1 exact match (1.0) so the matcher still ranks those first.
+EXACT_SEED_SCORE = 0.99
+PREFIX_SEED_SCORE = 0.98
+MAX_PREFIX_SEEDS = 2
+_ARTIST_CATEGORY = 1  # matched by exact name only, never embedded
+
+# INT8-quantized ONNX exports shipped in the model's hub repo
+_ONNX_MODEL_FILE = (
+    "onnx/model_qint8_arm64.onnx"
+    if platform.machine().lower() in ("arm64", "aarch64")
+    else "onnx/model_quint8_avx2.onnx"
+)
+
+
+def _load_onnx_embeddings() -> Optional[HuggingFaceEmbeddings]:
+    """MiniLM on ONNX Runtime with INT8 weights, or None if unavailable."""
+    if importlib.util.find_spec("onnxruntime") is None or importlib.util.find_spec("optimum") is None:
+        return None
+    try:
+        return HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL,
+            model_kwargs={
+                "device": "cpu",
+                "backend": "onnx",
+                "model_kwargs": {"file_name": _ONNX_MODEL_FILE},
+            },
+        )
+    except Exception as e:
+        print(f"Warning: ONNX embedding backend unavailable ({e}), using PyTorch")
+        return None
+
 
 class VectorSearch:
     _shared_embeddings: Optional[HuggingFaceEmbeddings] = None
 
     @classmethod
     def _get_embeddings(cls) -> HuggingFaceEmbeddings:
-        """Get or create shared embedding model (avoids ~10s reload on hot-swap)."""
+        """Get or create shared embedding model (avoids ~10s reload on hot-swap).
+
+        Prefers the quantized ONNX model (faster CPU inference, smaller
+        footprint) and falls back to the PyTorch one.
+        """
         if cls._shared_embeddings is None:
-            cls._shared_embeddings = HuggingFaceEmbeddings(
-                model_name="all-MiniLM-L6-v2",
+            cls._shared_embeddings = _load_onnx_embeddings() or HuggingFaceEmbeddings(
+                model_name=EMBEDDING_MODEL,
                 model_kwargs={"device": "cpu"},
             )
         return cls._shared_embeddings
 
-    def __init__(self, index_path: str = "data/faiss_index"):
+    # Query text → embedding, shared across instances like the model itself.
+    # An explicit LRU (rather than lru_cache) so batch_search can fill it
+    # from a single encoder call; guarded since searches run in threads.
+    _embed_cache: "OrderedDict[str, tuple[float, ...]]" = OrderedDict()
+    _embed_lock = threading.Lock()
+
+    @classmethod
+    def _embed_cached(cls, texts: list[str]) -> list[tuple[float, ...]]:
+        """Embeddings for texts, encoding only uncached ones, in one batch.
+
+        Nearly all of a search's latency is this inference; repeated tags
+        and k / min_score variants of a query reuse the vector.
+        """
+        cache = cls._embed_cache
+        with cls._embed_lock:
+            missing = [t for t in dict.fromkeys(texts) if t not in cache]
+            found = {t: cache[t] for t in texts if t in cache}
+
+        if missing:
+            for text, vec in zip(missing, cls._get_embeddings().embed_documents(missing)):
+                found[text] = tuple(vec)
+
+        with cls._embed_lock:
+            for text, vec in found.items():
+                cache[text] = vec
+                cache.move_to_end(text)
+            while len(cache) > EMBED_CACHE_SIZE:
+                cache.popitem(last=False)
+
+        return [found[t] for t in texts]
+
+    def __init__(self, index_path: str = "data/faiss_index", tag_db: Optional[TagDatabase] = None):
         self.index_path = index_path
+        # Dictionary side channel for exact / prefix hits (see _seed_results)
+        self.tag_db = tag_db
         self.embeddings = self._get_embeddings()
         self.vector_store: Optional[FAISS] = None
+        # Inner-product indexes (build_embeddings.py) score by cosine directly;
+        # older flat L2 indexes return squared distances.
+        self._inner_product = False
+        # Per instance and cleared on reload, so results never outlive their index
+        self._search_cached = lru_cache(maxsize=2048)(self._search_impl)
         self._load_index()
 
     def _load_index(self):
@@ -38,23 +126,33 @@ class VectorSearch:
             self.embeddings,
             allow_dangerous_deserialization=True,
         )
+        self._inner_product = self.vector_store.index.metric_type == faiss.METRIC_INNER_PRODUCT
+        if self._inner_product:
+            self.vector_store.distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
 
     def reload(self, index_path: str):
         """Reload with a different FAISS index. Reuses embedding model."""
         self.index_path = index_path
         self.vector_store = None
+        self._search_cached.cache_clear()
         self._load_index()
 
     @property
     def is_loaded(self) -> bool:
         return self.vector_store is not None
 
-    def search(self, query: str, k: int = 10, min_score: float = 0.0) -> list[dict]:
+    def search(
+        self, query: str, k: int = 10, min_score: float = 0.0,
+        normalized_query: Optional[str] = None,
+    ) -> list[dict]:
         """Perform similarity search. Returns list of {tag, category, count, score}.
 
-        Fetches extra candidates internally so that an exact-name match
-        (query == tag name) is virtually guaranteed to appear even when
-        alias-diluted embeddings push it down the ranking.
+        Exact and prefix name hits come from the tag database rather than
+        from boosting FAISS results, so the index is only asked for k
+        neighbours.
+
+        normalized_query may be passed by callers that already normalized
+        the query (TagDatabase._normalize form) to skip doing it again.
         """
         if not self.vector_store:
             return []
@@ -63,31 +161,84 @@ class VectorSearch:
         # underscores → spaces so the embedding model sees the same surface form.
         search_query = query.strip().replace("_", " ")
 
-        normalized_query = search_query.lower().replace(" ", "_").replace("-", "_")
+        if normalized_query is None:
+            normalized_query = search_query.lower().replace(" ", "_").replace("-", "_")
+
+        # Copy so callers can't mutate the cached results
+        return [dict(r) for r in self._search_cached(normalized_query, search_query, k, min_score)]
+
+    def _search_impl(
+        self, normalized_query: str, search_query: str, k: int, min_score: float,
+    ) -> list[dict]:
+        embedding = list(self._embed_cached([search_query])[0])
+        results = self.vector_store.similarity_search_with_score_by_vector(embedding, k=k)
+        return self._score_results(results, normalized_query, k, min_score)
 
-        # Fetch more candidates to increase chance of finding exact matches
-        fetch_k = max(k * 3, 30)
-        results = self.vector_store.similarity_search_with_score(search_query, k=fetch_k)
+    def batch_search(
+        self, queries: list[str], k: int = 10, min_score: float = 0.0,
+        normalized_queries: Optional[list[str]] = None,
+    ) -> list[list[dict]]:
+        """search() for many queries: one encoder pass and one FAISS probe for all."""
+        if not self.vector_store or not queries:
+            return [[] for _ in queries]
 
+        search_queries = [q.strip().replace("_", " ") for q in queries]
+        if normalized_queries is None:
+            normalized_queries = [q.lower().replace(" ", "_").replace("-", "_") for q in search_queries]
+
+        vecs = np.asarray(self._embed_cached(search_queries), dtype=np.float32)
+        scores, ids = self.vector_store.index.search(vecs, k)
+
+        docstore = self.vector_store.docstore
+        id_map = self.vector_store.index_to_docstore_id
         output = []
-        for doc, distance in results:
-            # FAISS returns squared L2 distance; convert to 0-1 similarity
-            # For unit vectors: ||a-b||² = 2(1 - cos_sim)  →  cos_sim = 1 - d/2
-            similarity = max(0.0, 1.0 - distance / 2.0)
+        for norm, row_scores, row_ids in zip(normalized_queries, scores, ids):
+            # FAISS pads with -1 when the index holds fewer than k vectors
+            results = [(docstore.search(id_map[i]), s) for s, i in zip(row_scores, row_ids) if i != -1]
+            output.append(self._score_results(results, norm, k, min_score))
+        return output
+
+    def _seed_results(self, normalized_query: str) -> list[dict]:
+        """Exact-name and token-boundary prefix hits from the tag database."""
+        if self.tag_db is None:
+            return []
+
+        def as_result(entry, score: float) -> dict:
+            return {"tag": entry.tag, "category": entry.category, "count": entry.count, "score": score}
+
+        seeds = []
+        exact = self.tag_db.exact_match_norm(normalized_query)
+        if exact and exact.category != _ARTIST_CATEGORY:
+            seeds.append(as_result(exact, EXACT_SEED_SCORE))
+
+        # Only extensions at a token boundary (hat → hat_ribbon, not hatsune_miku)
+        boundary = normalized_query + "_"
+        prefixed = 0
+        for entry in self.tag_db.search_prefix(boundary, limit=MAX_PREFIX_SEEDS * 5):
+            if entry.category == _ARTIST_CATEGORY:
+                continue
+            seeds.append(as_result(entry, PREFIX_SEED_SCORE))
+            prefixed += 1
+            if prefixed == MAX_PREFIX_SEEDS:
+                break
+        return seeds
+
+    def _score_results(self, results, normalized_query: str, k: int, min_score: float) -> list[dict]:
+        """Dictionary seeds followed by raw (doc, score) hits as sorted {tag, category, count, score} dicts."""
+        output = self._seed_results(normalized_query)
+        seen = {r["tag"] for r in output}
+        for doc, score in results:
+            if self._inner_product:
+                similarity = max(0.0, float(score))
+            else:
+                # Flat L2 index returns squared distance; convert to 0-1 similarity
+                # For unit vectors: ||a-b||² = 2(1 - cos_sim)  →  cos_sim = 1 - d/2
+                similarity = max(0.0, 1.0 - float(score) / 2.0)
             if similarity < min_score:
                 continue
             tag_name = doc.metadata["tag"]
-
-            # Boost score when the query closely matches the tag name itself.
-            # This compensates for embeddings that were diluted by alias text.
-            norm_tag = tag_name.lower()
-            if norm_tag == normalized_query:
-                # Exact name match → treat as near-perfect similarity
-                similarity = max(similarity, 0.99)
-            elif normalized_query in norm_tag or norm_tag in normalized_query:
-                # Substring containment → moderate boost
-                similarity = max(similarity, similarity + 0.10)
-                similarity = min(similarity, 0.98)
+            if tag_name in seen:
+                continue
 
             output.append({
                 "tag": tag_name,
@@ -96,6 +247,4 @@ class VectorSearch:
                 "score": round(similarity, 4),
             })
 
-        # Re-sort by boosted score and return top-k
-        output.sort(key=lambda x: x["score"], reverse=True)
-        return output[:k]
+        return heapq.nlargest(k, output, key=lambda x: x["score"])
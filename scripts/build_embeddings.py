@@ -6,44 +6,115 @@ Usage:
     python scripts/build_embeddings.py --source danbooru   # Build danbooru only
     python scripts/build_embeddings.py --source anima      # Build anima only
     python scripts/build_embeddings.py --source merged     # Build merged only
+    python scripts/build_embeddings.py --precision bf16    # Faster encode on bf16-capable CPUs
+    python scripts/build_embeddings.py --index-type ivfpq  # Compressed index for large tag sets
+    python scripts/build_embeddings.py --workers 8         # Encode on 8 CPU processes
+    python scripts/build_embeddings.py --no-cache          # Re-encode everything, ignoring the embedding cache
 
 This will create:
     - data/danbooru/tags.json + faiss_index/
     - data/anima/tags.json + faiss_index/
     - data/merged/tags.json + faiss_index/
-    - data/merged_tags.json (legacy compatibility)
-    - data/faiss_index/ (legacy compatibility)
+    - data/merged_tags.json (legacy link to merged/tags.json)
+    - data/faiss_index/ (legacy link to merged/faiss_index/)
+    - data/.embedding_cache/ (encoded vectors reused by later runs)
 """
 
 import argparse
-import csv
-import json
+import hashlib
 import os
+import pickle
 import shutil
+import sqlite3
 import sys
+import tempfile
 import time
+from collections import Counter
+from concurrent.futures import Executor, ThreadPoolExecutor
+from itertools import chain
+from operator import itemgetter
 from pathlib import Path
+from typing import Callable, Optional
 
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 DATA_DIR = PROJECT_ROOT / "data"
+EMBEDDING_CACHE_DIR = DATA_DIR / ".embedding_cache"
 
 VALID_SOURCES = ("danbooru", "anima", "merged", "all")
 
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+ENCODE_BATCH_SIZE = 256
+# Texts per encode() call when filling the on-disk embedding matrix; each
+# chunk is still length-sorted inside encode()
+ENCODE_CHUNK_SIZE = 16384
+PRECISIONS = ("fp32", "bf16", "int8")
+
+# HNSW graph parameters: neighbours per node, and build / query beam widths.
+# efSearch is stored in the index file and picked up by the backend.
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 128
+
+# IVF-PQ (--index-type ivfpq): OPQ rotation + 32-byte PQ codes per vector.
+# nlist grows with ~4*sqrt(N) up to IVF_NLIST_MAX; nprobe is stored in the
+# index file like efSearch.
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+IVF_NLIST_MAX = 4096
+IVF_NPROBE = 16
+IVF_TRAIN_SAMPLE = 100_000
+PQ_M = 32
+# k-means wants ~39 points per centroid; PQ trains 256 centroids per sub-space
+IVF_MIN_TRAIN_PER_LIST = 39
+PQ_MIN_TRAIN = 256 * IVF_MIN_TRAIN_PER_LIST
+
 
 def load_csv(filepath: str) -> list[dict]:
-    """Load a danbooru tag CSV file."""
-    tags = []
-    with open(filepath, encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            aliases = [a.strip() for a in row["alias"].split(",") if a.strip()] if row.get("alias") else []
-            tags.append({
-                "tag": row["tag"].strip(),
-                "category": int(row["category"]),
-                "count": int(row["count"]),
-                "aliases": aliases,
-            })
-    return tags
+    """Load a danbooru tag CSV file.
+
+    Parsed by pyarrow's multithreaded columnar reader; rows are only
+    materialized as dicts at the end.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+    except ImportError:
+        print("Error: Required packages not installed. Run:")
+        print("  pip install -r requirements.txt")
+        sys.exit(1)
+
+    table = pacsv.read_csv(
+        filepath,
+        convert_options=pacsv.ConvertOptions(column_types={
+            "tag": pa.string(),
+            "category": pa.int64(),
+            "count": pa.int64(),
+            "alias": pa.string(),
+        }),
+    )
+    if "alias" in table.column_names:
+        alias_col = table["alias"].to_pylist()
+    else:
+        alias_col = [None] * table.num_rows
+
+    return [
+        {
+            "tag": tag.strip(),
+            "category": category,
+            "count": count,
+            "aliases": [a.strip() for a in alias.split(",") if a.strip()] if alias else [],
+        }
+        for tag, category, count, alias in zip(
+            table["tag"].to_pylist(),
+            table["category"].to_pylist(),
+            table["count"].to_pylist(),
+            alias_col,
+        )
+    ]
+
+
+def _unique(items: list[str]) -> list[str]:
+    """Drop duplicates, keeping first-seen order."""
+    return list(dict.fromkeys(items))
 
 
 def merge_tags(danbooru_tags: list[dict], anima_tags: list[dict]) -> list[dict]:
@@ -56,53 +127,56 @@ def merge_tags(danbooru_tags: list[dict], anima_tags: list[dict]) -> list[dict]:
             "tag": t["tag"],
             "category": t["category"],
             "count": t["count"],
-            "aliases": list(set(t["aliases"])),
+            "aliases": _unique(t["aliases"]),
             "source": "anima",
         }
 
     # Merge danbooru_tags
     for t in danbooru_tags:
-        if t["tag"] in tag_map:
-            existing = tag_map[t["tag"]]
+        existing = tag_map.get(t["tag"])
+        if existing is not None:
             existing["count"] = max(existing["count"], t["count"])
-            # Merge aliases (union)
-            combined = set(existing["aliases"]) | set(t["aliases"])
-            existing["aliases"] = list(combined)
+            # Merge aliases (union); a lookup set only exists for collisions
+            aliases = existing["aliases"]
+            seen = set(aliases)
+            for alias in t["aliases"]:
+                if alias not in seen:
+                    seen.add(alias)
+                    aliases.append(alias)
             existing["source"] = "both"
         else:
             tag_map[t["tag"]] = {
                 "tag": t["tag"],
                 "category": t["category"],
                 "count": t["count"],
-                "aliases": list(set(t["aliases"])),
+                "aliases": _unique(t["aliases"]),
                 "source": "danbooru_only",
             }
 
-    merged = sorted(tag_map.values(), key=lambda x: x["count"], reverse=True)
+    merged = sorted(tag_map.values(), key=itemgetter("count"), reverse=True)
     return merged
 
 
+# Minimum count for a tag to be embedded, by category. Categories not listed
+# are never embedded (artist tags, cat 1, are matched by exact name only).
+EMBED_MIN_COUNT = {
+    0: 0,      # General: all
+    3: 100,    # Copyright
+    4: 100,    # Character
+    5: 1000,   # Meta
+}
+
+
 def select_tags_for_embedding(tags: list[dict]) -> list[dict]:
     """Select which tags to embed in FAISS index."""
-    selected = []
-    for t in tags:
-        cat = t["category"]
-        # General tags (cat 0): all
-        if cat == 0:
-            selected.append(t)
-        # Copyright (cat 3) and Character (cat 4): count >= 100
-        elif cat in (3, 4) and t["count"] >= 100:
-            selected.append(t)
-        # Meta tags (cat 5): count >= 1000
-        elif cat == 5 and t["count"] >= 1000:
-            selected.append(t)
-        # Artist tags (cat 1): skip (exact match only)
-    return selected
+    never = float("inf")
+    min_count = EMBED_MIN_COUNT.get
+    return [t for t in tags if t["count"] >= min_count(t["category"], never)]
 
 
 def _is_english_alias(alias: str) -> bool:
     """Check if an alias is primarily English/ASCII."""
-    return all(ord(c) < 128 for c in alias)
+    return alias.isascii()
 
 
 def build_embedding_text(tag: dict) -> str:
@@ -119,34 +193,195 @@ def build_embedding_text(tag: dict) -> str:
 
 
 def save_tags_json(tags: list[dict], path: Path):
-    """Save tag list as JSON file."""
+    """Save tag list as JSON file (UTF-8, compact; serialized by orjson)."""
+    import orjson
+
     path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(tags, f, ensure_ascii=False)
+    path.write_bytes(orjson.dumps(tags))
     print(f"  Saved {len(tags)} tags to {path}")
 
 
-def load_embedding_model():
-    """Load embedding model once for reuse across builds."""
+def load_embedding_model(precision: str = "fp32"):
+    """Load embedding model once for reuse across builds.
+
+    bf16 halves weight/activation traffic on CPUs with native bfloat16;
+    int8 applies dynamic quantization to the Linear layers for older CPUs.
+    """
     try:
-        from langchain_huggingface import HuggingFaceEmbeddings
+        from sentence_transformers import SentenceTransformer
     except ImportError:
         print("Error: Required packages not installed. Run:")
         print("  pip install -r requirements.txt")
         sys.exit(1)
 
-    print(f"\nLoading embedding model (all-MiniLM-L6-v2)...")
+    print(f"\nLoading embedding model ({EMBEDDING_MODEL})...")
     print("(First run will download ~80MB model)")
-    return HuggingFaceEmbeddings(
-        model_name="all-MiniLM-L6-v2",
-        model_kwargs={"device": "cpu"},
+    model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+
+    if precision == "bf16":
+        import torch
+        model = model.to(dtype=torch.bfloat16)
+    elif precision == "int8":
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if precision != "fp32":
+        print(f"  Encoder precision: {precision}")
+    return model
+
+
+def start_encode_pool(model, workers: int):
+    """Multi-process pool of `workers` CPU encoders for encode_texts()."""
+    print(f"  Starting {workers} encode workers...")
+    return model.start_multi_process_pool(target_devices=["cpu"] * workers)
+
+
+def encode_texts(model, texts: list[str], show_progress_bar: bool = False, pool=None):
+    """Unit-normalized float32 embeddings for texts, as an (n, dim) array.
+
+    Pass the whole list rather than pre-batching: encode() sorts texts by
+    length before batching (and restores the order afterwards), so each
+    batch pads only to similar-length neighbours. With a pool from
+    start_encode_pool() the list is split into chunks across the workers.
+    """
+    if pool is not None:
+        return model.encode_multi_process(
+            texts,
+            pool,
+            batch_size=ENCODE_BATCH_SIZE,
+            normalize_embeddings=True,
+            show_progress_bar=show_progress_bar,
+        )
+    return model.encode(
+        texts,
+        batch_size=ENCODE_BATCH_SIZE,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=show_progress_bar,
     )
 
 
-def build_faiss_index(tags_to_embed: list[dict], index_path: str, embeddings_model):
-    """Compute embeddings and build FAISS index at the given path."""
-    from langchain_community.vectorstores import FAISS
+class EmbeddingCache:
+    """Persistent text → embedding store shared by all builds and sources.
+
+    Rows live in data/.embedding_cache/<model>.sqlite as FP16 blobs keyed by
+    sha256(model|precision|text), so re-runs and texts shared between
+    sources skip the encoder.
+    """
+
+    # Stay under SQLITE_MAX_VARIABLE_NUMBER on older sqlite builds
+    _QUERY_CHUNK = 900
+
+    def __init__(self, precision: str):
+        EMBEDDING_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        self.path = EMBEDDING_CACHE_DIR / f"{EMBEDDING_MODEL}.sqlite"
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, vec BLOB NOT NULL)")
+        self.key_prefix = f"{EMBEDDING_MODEL}|{precision}|"
+
+    def _key(self, text: str) -> bytes:
+        return hashlib.sha256((self.key_prefix + text).encode("utf-8")).digest()
+
+    def encode(self, model, texts: list[str], pool=None):
+        """encode_texts() through the cache; only uncached texts hit the model."""
+        import numpy as np
+
+        keys = [self._key(t) for t in texts]
+        found: dict[bytes, bytes] = {}
+        for i in range(0, len(keys), self._QUERY_CHUNK):
+            chunk = keys[i:i + self._QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            found.update(self.conn.execute(
+                f"SELECT hash, vec FROM embeddings WHERE hash IN ({placeholders})", chunk,
+            ))
+
+        missing = {k: t for k, t in zip(keys, texts) if k not in found}
+        print(f"    Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} to encode")
+        if missing:
+            vectors = encode_texts(model, list(missing.values()), show_progress_bar=True, pool=pool).astype(np.float16)
+            rows = [(k, v.tobytes()) for k, v in zip(missing, vectors)]
+            self.conn.executemany("INSERT OR REPLACE INTO embeddings (hash, vec) VALUES (?, ?)", rows)
+            self.conn.commit()
+            found.update(rows)
+
+        # Fresh and cached vectors both go through FP16, so a text always
+        # gets the same vector whether or not it was cached
+        blob = b"".join(found[k] for k in keys)
+        return np.frombuffer(blob, dtype=np.float16).reshape(len(keys), -1).astype(np.float32)
+
+    def close(self):
+        self.conn.close()
+
+
+def make_encoder(model, cache: Optional[EmbeddingCache] = None, pool=None) -> Callable:
+    """texts → embedding matrix, through the cache and worker pool when given."""
+    def encode(texts: list[str]):
+        if cache is not None:
+            return cache.encode(model, texts, pool)
+        return encode_texts(model, texts, show_progress_bar=True, pool=pool)
+
+    return encode
+
+
+class PrecomputedEmbeddings:
+    """Encoder over a matrix filled by encode_union(): texts → their stored rows."""
+
+    def __init__(self, vectors, row_of: dict[str, int]):
+        self.vectors = vectors
+        self.row_of = row_of
+
+    def __call__(self, texts: list[str]):
+        import numpy as np
+
+        if not texts:
+            return np.empty((0, self.vectors.shape[1]), dtype=np.float32)
+        return np.asarray(self.vectors[[self.row_of[t] for t in texts]])
+
+
+def encode_union(encode: Callable, text_lists: list[list[str]]) -> PrecomputedEmbeddings:
+    """Encode the union of several text lists once.
+
+    Returns an encoder that serves any of those texts as rows of the
+    shared matrix, so sources built in the same run never re-encode
+    the texts they have in common. The matrix is a temporary np.memmap
+    filled ENCODE_CHUNK_SIZE texts at a time, so only one chunk's
+    embeddings are held in memory while encoding.
+    """
+    import numpy as np
+
+    union = list(dict.fromkeys(chain.from_iterable(text_lists)))
+    if not union:
+        print("\nNo tags selected for embedding in any source")
+        return PrecomputedEmbeddings(np.empty((0, 0), dtype=np.float32), {})
+    print(f"\nComputing embeddings for {len(union)} unique texts...")
 
+    start_time = time.time()
+    vectors = None
+    for start in range(0, len(union), ENCODE_CHUNK_SIZE):
+        chunk = encode(union[start:start + ENCODE_CHUNK_SIZE])
+        if vectors is None:
+            vectors = np.memmap(
+                tempfile.TemporaryFile(), mode="w+", dtype=np.float32, shape=(len(union), chunk.shape[1]),
+            )
+        vectors[start:start + len(chunk)] = chunk
+    elapsed = time.time() - start_time
+    rate = len(union) / elapsed if elapsed > 0 else 0
+    print(f"  {len(union)} texts in {elapsed:.1f}s  |  {rate:.0f} texts/s")
+
+    return PrecomputedEmbeddings(vectors, {text: i for i, text in enumerate(union)})
+
+
+def build_faiss_index(
+    tags_to_embed: list[dict],
+    index_path: str,
+    encode: Callable,
+    index_type: str = "hnsw",
+    executor: Optional[Executor] = None,
+):
+    """Compute embeddings with `encode` and build FAISS index at the given path.
+
+    With an executor only the encode runs here; building and saving the
+    index is submitted to it and a Future of the index is returned.
+    """
     texts = []
     metadatas = []
     for t in tags_to_embed:
@@ -158,41 +393,131 @@ def build_faiss_index(tags_to_embed: list[dict], index_path: str, embeddings_mod
         })
 
     total = len(texts)
-    print(f"  Computing embeddings for {total} tags...")
+    if isinstance(encode, PrecomputedEmbeddings):
+        # Already encoded and timed by encode_union(); this is a row gather
+        print(f"  Gathering {total} precomputed embeddings...")
+        vectors = encode(texts)
+    else:
+        print(f"  Computing embeddings for {total} tags...")
+
+        # One encode() call over the full list; sentence-transformers does the
+        # length-sorted batching internally and reports progress
+        start_time = time.time()
+        vectors = encode(texts)
+        elapsed = time.time() - start_time
+        rate = total / elapsed if elapsed > 0 else 0
+        print(f"    {total} tags in {elapsed:.1f}s  |  {rate:.0f} tags/s")
 
-    # Process in batches for progress reporting
-    BATCH_SIZE = 500
-    all_embeddings = []
-    start_time = time.time()
+    print(f"  Building FAISS index ({index_type}, inner product)...")
+    if executor is not None:
+        return executor.submit(_write_faiss_index, vectors, texts, metadatas, index_path, index_type)
+    return _write_faiss_index(vectors, texts, metadatas, index_path, index_type)
 
-    for i in range(0, total, BATCH_SIZE):
-        batch = texts[i:i + BATCH_SIZE]
-        batch_embeddings = embeddings_model.embed_documents(batch)
-        all_embeddings.extend(batch_embeddings)
 
-        done = min(i + BATCH_SIZE, total)
-        elapsed = time.time() - start_time
-        rate = done / elapsed if elapsed > 0 else 0
-        eta = (total - done) / rate if rate > 0 else 0
-        print(f"    [{done:>6}/{total}] {done/total*100:.1f}%  |  {rate:.0f} tags/s  |  ETA: {eta:.0f}s")
-
-    print(f"  Building FAISS index...")
-    text_embedding_pairs = list(zip(texts, all_embeddings))
-    vector_store = FAISS.from_embeddings(
-        text_embedding_pairs,
-        embeddings_model,
-        metadatas=metadatas,
-    )
+def _write_faiss_index(vectors, texts: list[str], metadatas: list[dict], index_path: str, index_type: str):
+    index = _build_index(vectors, index_type)
 
     os.makedirs(index_path, exist_ok=True)
-    vector_store.save_local(index_path)
+    _save_index(index, texts, metadatas, index_path)
     print(f"  FAISS index saved to {index_path}/")
 
-    return vector_store
+    return index
+
+
+def _build_index(embeddings, index_type: str = "hnsw"):
+    """Inner-product index of the given type over unit-normalized vectors.
+
+    On unit vectors inner product is cosine similarity, so the backend
+    reads scores directly (see VectorSearch) instead of converting L2
+    distances.
+    """
+    import faiss
+    import numpy as np
+
+    vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+    faiss.normalize_L2(vectors)
+
+    if index_type == "ivfpq" and len(vectors) < PQ_MIN_TRAIN:
+        print(f"    {len(vectors)} vectors is too few to train IVF-PQ; using hnsw")
+        index_type = "hnsw"
 
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(vectors.shape[1])
+    elif index_type == "ivfpq":
+        index = _build_ivfpq_index(vectors)
+    else:
+        index = _build_hnsw_index(vectors.shape[1])
+    index.add(vectors)
+    return index
 
-def build_source_set(tags: list[dict], output_dir: Path, label: str, embeddings_model):
-    """Build tags.json and FAISS index for a single source."""
+
+def _build_hnsw_index(dim: int):
+    """Empty HNSW graph; queries walk the graph rather than scanning every vector."""
+    import faiss
+
+    index = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
+
+
+def _build_ivfpq_index(vectors):
+    """OPQ + IVF-PQ index trained on a sample of `vectors` (not yet added).
+
+    Stores 32 bytes per vector instead of 1.5KB and only scans nprobe
+    lists per query, at the cost of approximate scores.
+    """
+    import faiss
+    import numpy as np
+
+    n, dim = vectors.shape
+    nlist = max(1, min(IVF_NLIST_MAX, int(4 * np.sqrt(n)), n // IVF_MIN_TRAIN_PER_LIST))
+    index = faiss.index_factory(dim, f"OPQ{PQ_M},IVF{nlist},PQ{PQ_M}", faiss.METRIC_INNER_PRODUCT)
+
+    rng = np.random.default_rng(0)
+    sample = vectors if n <= IVF_TRAIN_SAMPLE else vectors[rng.choice(n, IVF_TRAIN_SAMPLE, replace=False)]
+    print(f"    Training IVF{nlist},PQ{PQ_M} on {len(sample)} vectors...")
+    index.train(sample)
+    faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    return index
+
+
+def _save_index(index, texts: list[str], metadatas: list[dict], index_path: str):
+    """Write index.faiss + index.pkl in the layout FAISS.load_local() reads.
+
+    Docstore ids are the row numbers, so no LangChain store (and no list of
+    per-vector Python floats) is built just to serialize the index.
+    """
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_core.documents import Document
+
+    ids = [str(i) for i in range(len(texts))]
+    docstore = InMemoryDocstore({
+        doc_id: Document(page_content=text, metadata=meta)
+        for doc_id, text, meta in zip(ids, texts, metadatas)
+    })
+    index_to_docstore_id = dict(enumerate(ids))
+
+    faiss.write_index(index, str(Path(index_path) / "index.faiss"))
+    with open(Path(index_path) / "index.pkl", "wb") as f:
+        pickle.dump((docstore, index_to_docstore_id), f)
+
+
+def build_source_set(
+    tags: list[dict],
+    output_dir: Path,
+    label: str,
+    encode: Callable,
+    index_type: str = "hnsw",
+    executor: Optional[Executor] = None,
+):
+    """Build tags.json and FAISS index for a single source.
+
+    Returns (tag count, embedded count, index); with an executor the index
+    is a Future (see build_faiss_index). The index is None when no tag is
+    selected for embedding.
+    """
     print(f"\n{'─' * 50}")
     print(f"  Building: {label}")
     print(f"{'─' * 50}")
@@ -202,9 +527,7 @@ def build_source_set(tags: list[dict], output_dir: Path, label: str, embeddings_
 
     # Select and embed
     tags_to_embed = select_tags_for_embedding(tags)
-    cats = {}
-    for t in tags_to_embed:
-        cats[t["category"]] = cats.get(t["category"], 0) + 1
+    cats = Counter(t["category"] for t in tags_to_embed)
 
     cat_names = {0: "general", 1: "artist", 3: "copyright", 4: "character", 5: "meta"}
     print(f"  Tags for embedding: {len(tags_to_embed)}")
@@ -212,10 +535,48 @@ def build_source_set(tags: list[dict], output_dir: Path, label: str, embeddings_
         print(f"    Category {cat} ({cat_names.get(cat, 'unknown')}): {count}")
 
     # Build FAISS index
-    index_path = str(output_dir / "faiss_index")
-    build_faiss_index(tags_to_embed, index_path, embeddings_model)
+    index_path = output_dir / "faiss_index"
+    if not tags_to_embed:
+        # No index rather than an empty one; drop any stale index from a previous build
+        print("  No tags selected for embedding; skipping FAISS index")
+        _remove_path(index_path)
+        return len(tags), 0, None
+    index = build_faiss_index(tags_to_embed, str(index_path), encode, index_type, executor)
+
+    return len(tags), len(tags_to_embed), index
+
+
+def _remove_path(path: Path):
+    """Delete a file, symlink (without following it) or directory tree, if present."""
+    if path.is_symlink() or path.is_file():
+        path.unlink()
+    elif path.exists():
+        shutil.rmtree(path)
+
 
-    return len(tags), len(tags_to_embed)
+def link_legacy(target: Path, link: Path):
+    """Make `link` a relative symlink to `target`, replacing whatever is there.
+
+    Where symlinks are not permitted (Windows without developer mode) the
+    files are hard-linked instead, and copied if that fails too (e.g.
+    across filesystems).
+    """
+    _remove_path(link)
+    try:
+        link.symlink_to(os.path.relpath(target, link.parent), target_is_directory=target.is_dir())
+        return
+    except OSError:
+        pass
+
+    pairs = [(target, link)]
+    if target.is_dir():
+        link.mkdir()
+        pairs = [(f, link / f.name) for f in target.iterdir()]
+    for src, dst in pairs:
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
 
 
 def main():
@@ -226,6 +587,29 @@ def main():
         default="all",
         help="Which source to build (default: all)",
     )
+    parser.add_argument(
+        "--precision",
+        choices=PRECISIONS,
+        default="fp32",
+        help="Encoder precision: fp32, bf16 or int8 dynamic quantization (default: fp32)",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=INDEX_TYPES,
+        default="hnsw",
+        help="FAISS index: exact flat scan, HNSW graph, or compressed IVF-PQ (default: hnsw)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Encoder processes; >1 splits encoding across CPU cores (default: 1)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Encode every text instead of reusing vectors from data/.embedding_cache/",
+    )
     args = parser.parse_args()
 
     print("=" * 60)
@@ -250,55 +634,79 @@ def main():
     print(f"  Loaded {len(anima_tags)} tags")
 
     # Load embedding model once
-    embeddings_model = load_embedding_model()
-
-    DATA_DIR.mkdir(exist_ok=True)
-    build_targets = args.source
-    results = {}
-    start_total = time.time()
-
-    # Build danbooru-only
-    if build_targets in ("danbooru", "all"):
-        # Add source field for standalone danbooru tags
-        danbooru_with_source = []
-        for t in danbooru_tags:
-            danbooru_with_source.append({**t, "source": "danbooru_only"})
-        danbooru_sorted = sorted(danbooru_with_source, key=lambda x: x["count"], reverse=True)
-        tag_count, vec_count = build_source_set(
-            danbooru_sorted, DATA_DIR / "danbooru", "Danbooru Only", embeddings_model,
-        )
-        results["danbooru"] = (tag_count, vec_count)
-
-    # Build anima-only
-    if build_targets in ("anima", "all"):
-        anima_with_source = []
-        for t in anima_tags:
-            anima_with_source.append({**t, "source": "anima"})
-        anima_sorted = sorted(anima_with_source, key=lambda x: x["count"], reverse=True)
-        tag_count, vec_count = build_source_set(
-            anima_sorted, DATA_DIR / "anima", "Anima Only", embeddings_model,
-        )
-        results["anima"] = (tag_count, vec_count)
-
-    # Build merged
-    if build_targets in ("merged", "all"):
-        print(f"\nMerging tags...")
-        merged = merge_tags(danbooru_tags, anima_tags)
-        print(f"  Total unique tags: {len(merged)}")
-
-        tag_count, vec_count = build_source_set(
-            merged, DATA_DIR / "merged", "Merged (Both)", embeddings_model,
-        )
-        results["merged"] = (tag_count, vec_count)
-
-        # Legacy compatibility: copy merged outputs to old paths
-        legacy_tags = DATA_DIR / "merged_tags.json"
-        legacy_index = DATA_DIR / "faiss_index"
-        shutil.copy2(DATA_DIR / "merged" / "tags.json", legacy_tags)
-        if legacy_index.exists():
-            shutil.rmtree(legacy_index)
-        shutil.copytree(DATA_DIR / "merged" / "faiss_index", legacy_index)
-        print(f"\n  Legacy files updated: {legacy_tags}, {legacy_index}/")
+    embeddings_model = load_embedding_model(args.precision)
+    cache = None if args.no_cache else EmbeddingCache(args.precision)
+    pool = None
+    try:
+        if args.workers > 1:
+            pool = start_encode_pool(embeddings_model, args.workers)
+        encode = make_encoder(embeddings_model, cache, pool)
+
+        DATA_DIR.mkdir(exist_ok=True)
+        build_targets = args.source
+        results = {}
+        start_total = time.time()
+
+        # Tag lists for each requested source, in build order
+        jobs = []
+        if build_targets in ("danbooru", "all"):
+            # Add source field for standalone danbooru tags
+            danbooru_with_source = [{**t, "source": "danbooru_only"} for t in danbooru_tags]
+            danbooru_sorted = sorted(danbooru_with_source, key=itemgetter("count"), reverse=True)
+            jobs.append(("danbooru", danbooru_sorted, "Danbooru Only"))
+
+        if build_targets in ("anima", "all"):
+            anima_with_source = [{**t, "source": "anima"} for t in anima_tags]
+            anima_sorted = sorted(anima_with_source, key=itemgetter("count"), reverse=True)
+            jobs.append(("anima", anima_sorted, "Anima Only"))
+
+        if build_targets in ("merged", "all"):
+            print(f"\nMerging tags...")
+            merged = merge_tags(danbooru_tags, anima_tags)
+            print(f"  Total unique tags: {len(merged)}")
+            jobs.append(("merged", merged, "Merged (Both)"))
+
+        # The sources share most of their texts: encode the union once, into
+        # a disk-backed matrix
+        encode = encode_union(encode, [
+            [build_embedding_text(t) for t in select_tags_for_embedding(tags)]
+            for _, tags, _ in jobs
+        ])
+
+        if len(jobs) > 1:
+            # Encoding is already done; FAISS add/save releases the GIL, so the
+            # per-source index builds overlap on threads
+            with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="faiss-build") as executor:
+                pending = {
+                    source: build_source_set(tags, DATA_DIR / source, label, encode, args.index_type, executor)
+                    for source, tags, label in jobs
+                }
+                for source, (tag_count, vec_count, index_future) in pending.items():
+                    if index_future is not None:
+                        index_future.result()
+                    results[source] = (tag_count, vec_count)
+        else:
+            for source, tags, label in jobs:
+                tag_count, vec_count, _ = build_source_set(tags, DATA_DIR / source, label, encode, args.index_type)
+                results[source] = (tag_count, vec_count)
+
+        if "merged" in results:
+            # Legacy compatibility: point old paths at the merged outputs
+            legacy_tags = DATA_DIR / "merged_tags.json"
+            legacy_index = DATA_DIR / "faiss_index"
+            link_legacy(DATA_DIR / "merged" / "tags.json", legacy_tags)
+            if (DATA_DIR / "merged" / "faiss_index").exists():
+                link_legacy(DATA_DIR / "merged" / "faiss_index", legacy_index)
+                print(f"\n  Legacy files updated: {legacy_tags}, {legacy_index}/")
+            else:
+                _remove_path(legacy_index)
+                print(f"\n  Legacy files updated: {legacy_tags} (no merged index; removed {legacy_index}/)")
+    finally:
+        # Worker processes and the cache DB outlive a failed build otherwise
+        if pool is not None:
+            embeddings_model.stop_multi_process_pool(pool)
+        if cache is not None:
+            cache.close()
 
     elapsed = time.time() - start_total
     print(f"\n{'=' * 60}")
@@ -0,0 +1,105 @@
+"""
+Regression check: token-index pruning in fuzzy matching vs a full scan.
+
+Fuzzy phase 1 only scores tags sharing a near token with the query (see
+TagDatabase._fuzzy_candidates). Queries whose tokens were merged, split or
+misspelled are the ones that can slip past that index, so this compares
+pruned and unpruned results on such queries built from the tag data.
+
+Usage:
+    python scripts/check_fuzzy_pruning.py                         # data/merged/tags.json
+    python scripts/check_fuzzy_pruning.py --tags data/anima/tags.json --samples 1000
+
+Fails (exit 1) when pruning changes a query's best match, returns nothing
+where a full scan finds a match, or batch_fuzzy_match disagrees with
+fuzzy_match. Differences among lower-ranked alternatives are only counted:
+the two paths keep different 50-candidate phase-1 shortlists.
+
+Manual only: nothing runs it automatically (release.yml just packages). Run
+it after touching the token index, the pruning constants or fuzzy scoring.
+"""
+
+import argparse
+import random
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from backend.tag_database import TagDatabase  # noqa: E402
+
+THRESHOLD = 80
+LIMIT = 5
+
+# Queries that pruning once dropped entirely or lost the best match for
+KNOWN_QUERIES = [
+    "antonio(ragnarokonline)",
+    "taihou(forbiddenfruit)(azurlane)",
+    "momoka(bluearchive)",
+    "towelaroundwaist",
+    "laterbra",
+    "natsugxryoko",
+    "@d_tm",
+]
+
+
+def build_queries(tag_names: tuple[str, ...], samples: int, seed: int) -> list[str]:
+    """Known cases plus merged-token, split-token and dropped-character variants of real tags."""
+    rng = random.Random(seed)
+    names = [n for n in tag_names if len(n) >= 6]
+    queries = list(KNOWN_QUERIES)
+    for name in rng.sample(names, min(samples, len(names))):
+        queries.append(name.replace("_", ""))
+    for name in rng.sample(names, min(samples, len(names))):
+        i = rng.randrange(2, len(name) - 1)
+        queries.append(f"{name[:i]}_{name[i:]}")
+    for name in rng.sample(names, min(samples, len(names))):
+        i = rng.randrange(len(name))
+        queries.append(name[:i] + name[i + 1:])
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare pruned and full-scan fuzzy matching")
+    parser.add_argument("--tags", default=str(PROJECT_ROOT / "data" / "merged" / "tags.json"))
+    parser.add_argument("--samples", type=int, default=300, help="Queries per variant (default: 300)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    db = TagDatabase(args.tags)
+    queries = [
+        q for q in dict.fromkeys(db._normalize_once(q) for q in build_queries(db.tag_names, args.samples, args.seed))
+        if q and not db._direct_match(q)
+    ]
+    print(f"Checking {len(queries)} queries against {db.total_tags} tags...")
+
+    failures = []
+    lower_rank_diffs = 0
+    pruned_results = []
+    for q in queries:
+        pruned = db._fuzzy_match_impl(q, THRESHOLD, LIMIT)
+        full = db._fuzzy_match_impl(q, THRESHOLD, LIMIT, prune=False)
+        pruned_results.append(pruned)
+        if pruned[:1] != full[:1]:
+            failures.append((q, pruned, full))
+        elif pruned != full:
+            lower_rank_diffs += 1
+
+    batch = db.batch_fuzzy_match(queries, THRESHOLD, LIMIT)
+    batch_mismatches = sum(b != p for b, p in zip(batch, pruned_results))
+
+    for q, pruned, full in failures[:20]:
+        print(f"  {q!r}: pruned {[(e.tag, round(s, 3)) for e, s in pruned[:2]]}"
+              f" vs full {[(e.tag, round(s, 3)) for e, s in full[:2]]}")
+    print(f"  Best match changed or lost: {len(failures)}")
+    print(f"  Lower-ranked alternatives differ: {lower_rank_diffs}")
+    print(f"  batch_fuzzy_match != fuzzy_match: {batch_mismatches}")
+
+    if failures or batch_mismatches:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
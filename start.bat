@@ -201,7 +201,7 @@ echo.
 REM Open browser in background after server is ready
 start /b cmd /c ""%~f0" --open-browser"
 
-%PYTHON_CMD% -m uvicorn backend.main:app --host 127.0.0.1 --port 8000 2>&1
+%PYTHON_CMD% -m backend 2>&1
 set "SERVER_EXIT=%errorlevel%"
 echo Server exited with code %SERVER_EXIT% >> "%LOGFILE%"
 
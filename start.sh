@@ -77,4 +77,4 @@ elif command -v xdg-open &> /dev/null; then
 fi
 
 # Start server
-python3 -m uvicorn backend.main:app --host 127.0.0.1 --port 8000
+python3 -m backend